@@ -0,0 +1 @@
+# Load benchmarks of the trivia API, see benchmarks/run.py
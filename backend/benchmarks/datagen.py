@@ -0,0 +1,44 @@
+import random
+from flaskr import create_app
+from flaskr.bulk import write_batch
+from models import db, Question, Category
+
+CATEGORIES = ('Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports')
+DIFFICULTIES = (1, 2, 3, 4, 5)
+WORDS = ('what', 'which', 'who', 'where', 'when', 'largest', 'first', 'famous', 'river', 'painting',
+         'planet', 'country', 'player', 'movie', 'element', 'invented', 'discovered', 'world', 'cup',
+         'ocean', 'capital', 'city', 'artist', 'novel', 'king', 'queen', 'battle', 'century', 'team',
+         'record', 'album', 'mountain', 'desert', 'island', 'language', 'animal', 'organ', 'metal')
+BATCH_SIZE = 10000
+
+
+def make_question(rnd, category_ids):
+    words = rnd.sample(WORDS, rnd.randint(4, 9))
+    return {
+        'question': ' '.join(words).capitalize() + '?',
+        'answer': ' '.join(rnd.sample(WORDS, rnd.randint(1, 3))).title(),
+        'difficulty': rnd.choice(DIFFICULTIES),
+        'category': rnd.choice(category_ids)
+    }
+
+
+# fill the database at uri with rows synthetic questions spread over the
+# categories and difficulties, the tables are created when missing. the same
+# seed gives the same bank.
+def generate(uri, rows, seed=1):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': uri})
+    rnd = random.Random(seed)
+    with app.app_context():
+        db.create_all()
+        if not Category.query.count():
+            for category in CATEGORIES:
+                db.session.add(Category(type=category))
+            db.session.commit()
+        category_ids = [ category.id for category in Category.query.all() ]
+        created = 0
+        while created < rows:
+            batch = [ make_question(rnd, category_ids) for _ in range(min(BATCH_SIZE, rows - created)) ]
+            write_batch(batch)
+            db.session.commit()
+            created += len(batch)
+        return Question.query.count()
@@ -0,0 +1,199 @@
+"""Load benchmark of the trivia API.
+
+Drives every route (listing, search, quiz, create, delete...) with a
+synthetic question bank and reports p50/p95/p99 latency and throughput.
+
+    python -m benchmarks.run --database sqlite:////tmp/trivia_bench.db --generate 100000
+    python -m benchmarks.run --database postgresql://localhost/trivia_bench --http http://127.0.0.1:5000 --concurrency 16
+    python -m benchmarks.run --database sqlite:////tmp/trivia_bench.db --baseline benchmarks/baselines/sqlite.json --save
+
+Without --http the routes run in process through the Flask test client, one
+request at a time. With --http the requests go to a running server (pointed
+at the same database) from --concurrency threads. A baseline file keeps the
+numbers of a run (--save); later runs fail when a route's p95 gets more than
+--tolerance slower than it.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from flaskr import create_app
+from models import db, Question, Category
+from .datagen import generate, WORDS
+
+
+# what the scenarios draw their requests from
+class BenchContext:
+
+    def __init__(self):
+        self.total = Question.query.count()
+        self.category_ids = [ category.id for category in Category.query.all() ]
+        self.sample_ids = [ row[ 0 ] for row in db.session.query(Question.id).limit(1000) ]
+        self.created_ids = [ ]
+        self.sessions = [ ]
+
+
+def new_question(rnd, ctx):
+    return {'question': 'benchmark question %d' % rnd.randint(0, 10 ** 9), 'answer': 'benchmark',
+            'difficulty': rnd.randint(1, 5), 'category': rnd.choice(ctx.category_ids)}
+
+
+# every scenario makes the (method, path, json body) of one request
+SCENARIOS = {
+    'list_page': lambda rnd, ctx: ('GET', '/questions?page=%d' % rnd.randint(1, max(ctx.total // 10, 1)), None),
+    'list_cursor': lambda rnd, ctx: ('GET', '/questions?cursor=', None),
+    'list_category': lambda rnd, ctx: ('POST', '/category/questions?page=%d' % rnd.randint(1, 5),
+                                       {'category': rnd.choice(ctx.category_ids)}),
+    'categories': lambda rnd, ctx: ('GET', '/categories', None),
+    'search': lambda rnd, ctx: ('POST', '/questions/search', {'searchTerm': ' '.join(rnd.sample(WORDS, 2))}),
+    'suggest': lambda rnd, ctx: ('GET', '/questions/suggest?q=' + rnd.choice(WORDS)[ :3 ], None),
+    'quiz': lambda rnd, ctx: ('POST', '/category/quiz/questions',
+                              {'category': rnd.choice(ctx.category_ids),
+                               'previousQuestions': rnd.sample(ctx.sample_ids, min(20, len(ctx.sample_ids)))}),
+    'create': lambda rnd, ctx: ('POST', '/questions?return=minimal', new_question(rnd, ctx)),
+    'delete': lambda rnd, ctx: ('DELETE', '/questions/%d?return=minimal' % ctx.created_ids.pop(), None)
+                               if ctx.created_ids else None,
+}
+
+
+# latency percentile (nearest rank) in milliseconds
+def percentile(latencies, rank):
+    ordered = sorted(latencies)
+    return round(ordered[ min(len(ordered) - 1, int(len(ordered) * rank / 100.0)) ] * 1000, 3)
+
+
+def summary(latencies, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None
+    }
+
+
+# run a scenario through the flask test client, one request at a time
+def run_in_process(client, scenario, ctx, count, rnd):
+    latencies = [ ]
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(count):
+        request = SCENARIOS[ scenario ](rnd, ctx)
+        if request is None:
+            break
+        method, path, body = request
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code >= 500:
+            errors += 1
+        elif scenario == 'create' and response.status_code == 200:
+            ctx.created_ids.append(response.get_json()[ 'created' ])
+    return latencies, errors, time.perf_counter() - started
+
+
+def http_request(base_url, request):
+    method, path, body = request
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    http_request = urllib.request.Request(base_url + path, data=data, method=method,
+                                          headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            payload = response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        payload = error.read()
+        status = error.code
+    return time.perf_counter() - start, status, payload
+
+
+# run a scenario against a server from concurrency threads
+def run_over_http(base_url, scenario, ctx, count, concurrency, rnd):
+    requests = [ ]
+    for _ in range(count):
+        request = SCENARIOS[ scenario ](rnd, ctx)
+        if request is None:
+            break
+        requests.append(request)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda request: http_request(base_url, request), requests))
+    elapsed = time.perf_counter() - started
+    if scenario == 'create':
+        ctx.created_ids += [ json.loads(payload)[ 'created' ] for _, status, payload in results if status == 200 ]
+    return [ latency for latency, _, _ in results ], sum(status >= 500 for _, status, _ in results), elapsed
+
+
+# routes whose p95 got slower than the baseline by more than tolerance
+def regressions(results, baseline, tolerance):
+    slower = [ ]
+    for scenario, result in results.items():
+        before = baseline.get('results', {}).get(scenario)
+        if before and result[ 'p95_ms' ] > before[ 'p95_ms' ] * (1 + tolerance):
+            slower.append('%s p95 %.3fms > baseline %.3fms' % (scenario, result[ 'p95_ms' ], before[ 'p95_ms' ]))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load benchmark of the trivia API.')
+    parser.add_argument('--database', required=True, help='SQLAlchemy uri of the benchmark database.')
+    parser.add_argument('--generate', type=int, default=0, help='Add that many synthetic questions first.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated scenarios to run.')
+    parser.add_argument('--http', help='Base url of a running server to drive instead of the test client.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Threads sending requests with --http.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', help='Baseline json to compare with (or to write with --save).')
+    parser.add_argument('--save', action='store_true', help='Write this run as the baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 slowdown, 0.25 is 25%%.')
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        print('generated, %d questions in the bank' % generate(args.database, args.generate, args.seed))
+
+    # with the response cache on the repeated reads would only measure the
+    # cache, and the rate limits would refuse the benchmark as a burst
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database, 'RESPONSE_CACHE_SIZE': 0, 'RATE_LIMITS': {}})
+    rnd = random.Random(args.seed)
+    results = {}
+    with app.app_context():
+        ctx = BenchContext()
+        client = app.test_client()
+        for scenario in args.scenarios.split(','):
+            if args.http:
+                latencies, errors, elapsed = run_over_http(args.http.rstrip('/'), scenario, ctx,
+                                                           args.requests, args.concurrency, rnd)
+            else:
+                latencies, errors, elapsed = run_in_process(client, scenario, ctx, args.requests, rnd)
+            if latencies:
+                results[ scenario ] = summary(latencies, errors, elapsed)
+                print('%-14s %5d req  p50 %8.3fms  p95 %8.3fms  p99 %8.3fms  %8.1f req/s  %d errors' % (
+                    scenario, results[ scenario ][ 'requests' ], results[ scenario ][ 'p50_ms' ],
+                    results[ scenario ][ 'p95_ms' ], results[ scenario ][ 'p99_ms' ],
+                    results[ scenario ][ 'throughput_rps' ], errors))
+        run = {'database': app.config[ 'SQLALCHEMY_DATABASE_URI' ].split('://')[ 0 ], 'questions': ctx.total,
+               'driver': 'http' if args.http else 'test_client', 'results': results}
+
+    if args.baseline and args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(run, baseline_file, indent=2, sort_keys=True)
+        print('baseline written to ' + args.baseline)
+    elif args.baseline:
+        with open(args.baseline) as baseline_file:
+            slower = regressions(results, json.load(baseline_file), args.tolerance)
+        for line in slower:
+            print('REGRESSION ' + line)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Startup benchmark of the trivia API.
+
+Starts fresh interpreters that import flaskr, create the app and serve a
+first request (which warms the in-memory indexes), and reports how long each
+step takes and how many modules were loaded.
+
+    python -m benchmarks.startup --database sqlite:////tmp/trivia_bench.db --runs 10
+    python -m benchmarks.startup --database sqlite:////tmp/trivia_bench.db --baseline benchmarks/baselines/startup.json --save
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from .run import summary, regressions
+
+# run in each fresh interpreter, prints the timings as json
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+from flaskr import create_app
+imported = time.perf_counter()
+app = create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[ 1 ]})
+created = time.perf_counter()
+response = app.test_client().get(sys.argv[ 2 ])
+served = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first_request': served - created, 'status': response.status_code,
+                  'modules': len(sys.modules)}))
+'''
+STEPS = ('import', 'create_app', 'first_request')
+
+
+def probe(database, path):
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([ sys.executable, '-c', PROBE, database, path ], cwd=backend)
+    return json.loads(output.decode('utf-8').strip().splitlines()[ -1 ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Startup benchmark of the trivia API.')
+    parser.add_argument('--database', required=True, help='SQLAlchemy uri of the benchmark database.')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters started.')
+    parser.add_argument('--path', default='/categories', help='Path of the first request.')
+    parser.add_argument('--baseline', help='Baseline json to compare with (or to write with --save).')
+    parser.add_argument('--save', action='store_true', help='Write this run as the baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 slowdown, 0.25 is 25%%.')
+    args = parser.parse_args(argv)
+
+    probes = [ probe(args.database, args.path) for _ in range(args.runs) ]
+    errors = sum(result[ 'status' ] >= 500 for result in probes)
+    results = {}
+    for step in STEPS + ('total',):
+        timings = [ sum(result[ name ] for name in STEPS) if step == 'total' else result[ step ]
+                    for result in probes ]
+        results[ step ] = summary(timings, errors, None)
+        print('%-14s %3d runs  p50 %8.1fms  p95 %8.1fms' % (step, args.runs, results[ step ][ 'p50_ms' ],
+                                                            results[ step ][ 'p95_ms' ]))
+    modules = max(result[ 'modules' ] for result in probes)
+    print('modules loaded %d' % modules)
+    run = {'database': args.database.split('://')[ 0 ], 'modules': modules, 'results': results}
+
+    if args.baseline and args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(run, baseline_file, indent=2, sort_keys=True)
+        print('baseline written to ' + args.baseline)
+    elif args.baseline:
+        with open(args.baseline) as baseline_file:
+            slower = regressions(results, json.load(baseline_file), args.tolerance)
+        for line in slower:
+            print('REGRESSION ' + line)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,24 +1,146 @@
 import os
 from flask_cors import CORS
-import random
 import json
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort
-from models import setup_db, Question, Category, database_name
+import base64
+import click
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort, \
+    stream_with_context
+from flask.cli import AppGroup
+from werkzeug.utils import import_string
+from sqlalchemy import and_, or_
+from models import setup_db, db, pool_status, Question, database_name
+from .categories import CategoryRegistry
+from .tracked import TableVersions
+from .quiz import QuestionIndex, QuizSessionStore, MIN_DIFFICULTY, MAX_DIFFICULTY, ADAPTIVE_START_DIFFICULTY
+from .search import QuestionSearch
+from .suggest import SuggestIndex
+from .bulk import import_questions
+from .batch import BATCH_UPDATE_FIELDS, batch_ids, parse_ids, fetch_questions, delete_questions, update_questions
+from .export import export_rows, ndjson_chunks, csv_chunks
+from .etag import conditional
+from .serialize import question_rows, format_rows, fast_response
+from .indexes import check_indexes
+from .cache import ResponseCache
+from .metrics import Metrics, stats_lines
+from .profiler import QueryProfiler
+from .replicas import ReplicaRouter, read_only
+from .compress import compress_response
+from .limits import Admission
 
 # variable for pagination
 QUESTIONS_PER_PAGE = 10
 
 
-# pagination function
-def my_page(req, questions):
+# offset of the first question of the requested page, None for pages below 1
+def page_start(req):
     page = req.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    formatted_questions = [ question.format() for question in questions ]
-    current_questions = formatted_questions[ start:end ]
-    return current_questions
+    if page < 1:
+        return None
+    return (page - 1) * QUESTIONS_PER_PAGE
+
+
+# pagination function, the page is cut by the database (LIMIT/OFFSET) and the
+# total comes from a separate COUNT so only one page of rows is ever loaded,
+# read as plain column tuples
+def my_page(req, query):
+    start = page_start(req)
+    if start is None:
+        return [], 0
+    current_questions = format_rows(question_rows(query).offset(start).limit(QUESTIONS_PER_PAGE))
+    total_questions = query.order_by(None).count()
+    return current_questions, total_questions
+
+
+# cursors are opaque url safe tokens holding the sort key of the last row
+# sent, a NULL (category of a question whose category was deleted) as null
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    except (ValueError, TypeError):
+        abort(400)
+    if not isinstance(key, list) or len(key) != size or type(key[ -1 ]) is not int or \
+            not all(value is None or type(value) is int for value in key[ :-1 ]):
+        abort(400)
+    return key
+
+
+# cursor sent with the request as ?cursor= (or ?after=) or in the json body,
+# None means the client is paging by number
+def request_cursor(req, body=None):
+    cursor = req.args.get('cursor', req.args.get('after'))
+    if cursor is None and body is not None:
+        cursor = body.get('cursor', body.get('after'))
+    return cursor
+
+
+# order of the sort key, NULLs after every value whatever the database's default
+def key_order(keys):
+    return [ column.asc().nullslast() for column in keys ]
+
+
+# keyset pagination, seeks past the last row of the previous page on the sort
+# key (e.g. (category, id)) so a page costs the same however deep it is. the
+# last column (id) is never NULL, the others sort their NULLs last
+def my_cursor_page(cursor, query, keys):
+    if cursor:
+        last = decode_cursor(cursor, len(keys))
+        seek = keys[ -1 ] > last[ -1 ]
+        for column, value in reversed(list(zip(keys[ :-1 ], last[ :-1 ]))):
+            if value is None:
+                seek = and_(column.is_(None), seek)
+            else:
+                seek = or_(column > value, column.is_(None), and_(column == value, seek))
+        query = query.filter(seek)
+    questions = question_rows(query).order_by(*key_order(keys)).limit(QUESTIONS_PER_PAGE + 1).all()
+    next_cursor = None
+    if len(questions) > QUESTIONS_PER_PAGE:
+        questions = questions[ :QUESTIONS_PER_PAGE ]
+        next_cursor = encode_cursor([ getattr(questions[ -1 ], column.key) for column in keys ])
+    return format_rows(questions), next_cursor
+
+
+# page a question query by cursor when one is sent, otherwise by page number,
+# returns the page, the total (None for cursors, no COUNT is run) and next cursor
+def paginate(req, query, keys, cursor=None):
+    if cursor is None:
+        page_questions, total_questions = my_page(req, query.order_by(*key_order(keys)))
+        return page_questions, total_questions, None
+    page_questions, next_cursor = my_cursor_page(cursor, query, keys)
+    return page_questions, None, next_cursor
+
+
+# ----------------------------------------------------------------------------#
+# Filters.
+# ----------------------------------------------------------------------------#
+
+def format_datetime(value, format='medium'):
+    # babel and dateutil are only imported by templates using the filter
+    import dateutil.parser
+    from babel.dates import format_datetime as babel_format_datetime
+    if isinstance(value, str):
+        date = dateutil.parser.parse(value)
+    else:
+        date = value
+
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel_format_datetime(date, format, locale='en')
+
+
+# the jinja environment, with the datetime filter, is set up by the first
+# template rendered (the JSON API renders none) instead of at boot
+class TriviaFlask(Flask):
+
+    def create_jinja_environment(self):
+        environment = super().create_jinja_environment()
+        environment.filters[ 'datetime' ] = format_datetime
+        return environment
 
 
 # ----------------------------------------------------------------------------#
@@ -26,36 +148,135 @@ def my_page(req, questions):
 # ----------------------------------------------------------------------------#
 def create_app(test_config=None):
     # create and configure the app
-    app = Flask(__name__, instance_relative_config=True)
+    app = TriviaFlask(__name__, instance_relative_config=True)
     setup_db(app, database_name)
+    # settings given to the factory win over instance/config.py, the engine
+    # is only created on first use so the database uri can be changed here
+    if test_config is not None:
+        app.config.update(test_config)
     CORS(app)
 
+    # write versions of the tables shared by all the processes
+    TableVersions(app)
+    # categories and the quiz question ids are kept in memory, warmed before
+    # the first request (not here so the factory never needs a database) and
+    # reloaded when their table is written
+    category_registry = CategoryRegistry()
+    question_index = QuestionIndex()
+    question_search = QuestionSearch(app.config.get('SEARCH_BACKEND', 'auto'))
+    suggest_index = SuggestIndex()
+    # serialized responses of the read endpoints, see LRUCache for backends
+    cache_backend = import_string(app.config.get('RESPONSE_CACHE_BACKEND', 'flaskr.cache.LRUCache'))
+    response_cache = ResponseCache(cache_backend(app.config.get('RESPONSE_CACHE_SIZE', 1024),
+                                                 app.config.get('RESPONSE_CACHE_TTL', 60)))
+    metrics = Metrics(app)
+    metrics.collectors.append(lambda: stats_lines('trivia_cache', response_cache.stats()))
+    metrics.collectors.append(lambda: stats_lines('trivia_db_pool', pool_status(db.engine)))
+    profiler = QueryProfiler(app, lambda: db.engine)
+    # views marked read_only read from SQLALCHEMY_REPLICA_URIS when set
+    replica_router = ReplicaRouter(app)
+    # rate limits and concurrency caps of RATE_LIMITS
+    admission = Admission(app)
+    metrics.collectors.append(admission.metric_lines)
+    app.extensions.setdefault('question_observers', [ ]).extend([ question_index.observe,
+                                                                   question_search.observe,
+                                                                   suggest_index.observe ])
+    quiz_sessions = QuizSessionStore(app.config.get('QUIZ_SESSION_TTL', 30 * 60),
+                                     app.config.get('QUIZ_SESSION_LIMIT', 10000))
+
+    @app.before_first_request
+    def warm_up():
+        category_registry.load()
+        question_index.load()
+
+    def category_exists(category):
+        return category_registry.get(category) is not None
+
+    def valid_difficulty(difficulty):
+        return type(difficulty) is int and MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY
+
+    # writes answer with only the id and total when the client asks for
+    # ?return=minimal (or Prefer: return=minimal), or by default when
+    # WRITE_RESPONSE is 'minimal' (then ?return=full gives the page back)
+    def minimal_response():
+        preference = request.args.get('return')
+        if preference is None and 'return=minimal' in request.headers.get('Prefer', ''):
+            preference = 'minimal'
+        return (preference or app.config.get('WRITE_RESPONSE', 'full')) == 'minimal'
+
+    # ----------------------------------------------------------------------------#
+    # Commands.
+    # ----------------------------------------------------------------------------#
+
+    questions_cli = AppGroup('questions', help='Manage the question bank.')
+
+    # flask questions import FILE, loads a ndjson or csv file of questions
+    @questions_cli.command('import')
+    @click.argument('file', type=click.File('r', encoding='utf-8'))
+    @click.option('--format', 'data_format', type=click.Choice([ 'ndjson', 'csv' ]),
+                  help='File format, guessed from the file extension when not given.')
+    @click.option('--batch-size', type=int, default=None, help='Questions written per transaction.')
+    def import_questions_command(file, data_format, batch_size):
+        if data_format is None:
+            data_format = 'csv' if file.name.endswith('.csv') else 'ndjson'
+        report = import_questions(file, data_format, category_exists,
+                                  batch_size or app.config.get('BULK_BATCH_SIZE', 1000),
+                                  app.config.get('BULK_MAX_ERRORS', 100))
+        for error in report[ 'errors' ]:
+            click.echo('line %d: %s' % (error[ 'line' ], error[ 'error' ]), err=True)
+        click.echo('%d questions imported, %d refused' % (report[ 'inserted' ], report[ 'failed' ]))
+
+    app.cli.add_command(questions_cli)
+
+    pool_cli = AppGroup('pool', help='Database connection pool.')
+
+    # flask pool stats, prints the pool counters of a running server
+    @pool_cli.command('stats')
+    @click.option('--url', default='http://127.0.0.1:5000', show_default=True,
+                  help='Server whose /admin/pool is read.')
+    def pool_stats_command(url):
+        import urllib.request
+        with urllib.request.urlopen(url.rstrip('/') + '/admin/pool') as response:
+            status = json.load(response)[ 'pool' ]
+        for key, value in status.items():
+            click.echo('%s: %s' % (key, value))
+
+    app.cli.add_command(pool_cli)
+
+    indexes_cli = AppGroup('indexes', help='Database indexes.')
+
+    # flask indexes check, explains the hot queries and fails when one of them
+    # can't use its index (e.g. the migrations were not applied)
+    @indexes_cli.command('check')
+    @click.option('--verbose', is_flag=True, help='Print the plan of every query.')
+    def check_indexes_command(verbose):
+        missing = 0
+        for result in check_indexes():
+            if result[ 'index' ] is None:
+                missing += 1
+                click.echo('MISSING %s: expected %s' % (result[ 'query' ], ' or '.join(result[ 'expected' ])))
+            else:
+                click.echo('ok      %s: %s' % (result[ 'query' ], result[ 'index' ]))
+            if verbose or result[ 'index' ] is None:
+                click.echo('        ' + result[ 'plan' ].replace('\n', '\n        '))
+        if missing:
+            raise SystemExit(1)
+
+    app.cli.add_command(indexes_cli)
+
     # CORS Headers
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,PATCH,POST,DELETE,OPTIONS')
         return response
 
-    # connection in configuration file added
-
-    # ----------------------------------------------------------------------------#
-    # Filters.
-    # ----------------------------------------------------------------------------#
-
-    def format_datetime(value, format='medium'):
-        if isinstance(value, str):
-            date = dateutil.parser.parse(value)
-        else:
-            date = value
-
-        if format == 'full':
-            format = "EEEE MMMM, d, y 'at' h:mma"
-        elif format == 'medium':
-            format = "EE MM, dd, y h:mma"
-        return babel.dates.format_datetime(date, format, locale='en')
+    # gzip (or brotli) bodies of compressible responses for clients accepting it
+    @app.after_request
+    def compress(response):
+        return compress_response(response, app.config)
 
-    app.jinja_env.filters[ 'datetime' ] = format_datetime
+    # connection in configuration file added
 
     # ----------------------------------------------------------------------------#
     # Controllers.
@@ -63,49 +284,56 @@ def create_app(test_config=None):
 
     # Get all questions with/without categories and paginated
     @app.route('/questions', methods=[ 'GET' ])
+    @read_only
+    @conditional('questions', 'categories')
+    @response_cache.cached
     def get_questions_per_page():
+        # ?ids=1,2,3 fetches those questions in one query
+        if 'ids' in request.args:
+            return get_questions_by_ids(request.args[ 'ids' ])
         # check if category is sent as argument and store id
         category = request.args.get('category', 0, type=int)
+        cursor = request_cursor(request)
         # if no category sent display all in page
         if category == 0:
-            questions = Question.query.order_by('category').all()
-            page_questions = my_page(request, questions)
-            categories = Category.query.all()
-            category_names = [ ]
-            for cat in categories:
-                category_names.append(cat.type)
+            page_questions, total_questions, next_cursor = paginate(request, Question.query,
+                                                                    [ Question.category, Question.id ], cursor)
+            category_names = category_registry.get_names()
 
             if len(page_questions):
-                return jsonify({
+                response = {
                     'success': True,
                     'questions': page_questions,
-                    'total_questions': len(questions),
+                    'total_questions': total_questions,
                     'current_category': 'All',
                     'categories': category_names
-                })
+                }
+                if cursor is not None:
+                    response[ 'next_cursor' ] = next_cursor
+                return fast_response(response)
             else:
                 abort(404)
         # if an category id is sent display questions with that id
         elif isinstance(category, int):
-            questions = Question.query.filter(Question.category == category).all()
+            questions = Question.query.filter(Question.category == category)
             if questions is not None:
-                page_questions = my_page(request, questions)
-                current_category_data = Category.query.get(category)
-                if current_category_data is not None:
-                    current_category = current_category_data.type
-                    categories = Category.query.all()
-                    category_names = [ ]
-                    for cat in categories:
-                        category_names.append(cat.type)
+                page_questions, total_questions, next_cursor = paginate(request, questions,
+                                                                        [ Question.id ], cursor)
+                current_category = category_registry.get(category)
+                if current_category is not None:
+                    category_names = category_registry.get_names()
 
                     if len(page_questions):
-                        return jsonify({
+                        response = {
                             'success': True,
                             'questions': page_questions,
-                            'total_questions': len(questions),
+                            'total_questions': total_questions,
                             'current_category': current_category,
                             'categories': category_names
-                        })
+                        }
+                        if cursor is not None:
+                            response[ 'next_cursor' ] = next_cursor
+                        return fast_response(response)
                     else:
                         abort(404)
                 else:
@@ -115,11 +343,28 @@ def create_app(test_config=None):
         else:
             abort(404)
 
+    def get_questions_by_ids(text):
+        ids = parse_ids(text, app.config.get('BATCH_MAX_IDS', 1000))
+        if ids is None:
+            abort(400)
+        questions, missing = fetch_questions(ids)
+        if len(questions):
+            return fast_response({
+                'success': True,
+                'questions': questions,
+                'missing': missing,
+                'total_questions': len(questions)
+            })
+        else:
+            abort(404)
+
     # get all available categories
     @app.route('/categories', methods=['GET'])
+    @read_only
+    @conditional('categories')
+    @response_cache.cached
     def get_all_categories():
-        categories = Category.query.order_by('id').all()
-        category = [ cat.format() for cat in categories ]
+        category = category_registry.get_all()
 
         if len(category):
             return jsonify({
@@ -137,13 +382,20 @@ def create_app(test_config=None):
             question = Question.query.filter_by(id=question_id).one_or_none()
             if question is not None:
                 question.delete()
-                questions = Question.query.order_by('id').all()
-                current_questions = my_page(request, questions)
+                response_cache.invalidate()
+                if minimal_response():
+                    return jsonify({
+                        'success': True,
+                        'deleted_question': question_id,
+                        'total_questions': question_index.count()
+                    })
+                questions = Question.query.order_by(Question.id)
+                current_questions, total_questions = my_page(request, questions)
                 return jsonify({
                     'success': True,
                     'deleted_question': question_id,
                     'current_questions': current_questions,
-                    'total_questions': len(questions)
+                    'total_questions': total_questions
                 })
             else:
                 abort(404)
@@ -173,31 +425,88 @@ def create_app(test_config=None):
                                     category=new_category
                                     )
                 question.insert()
+                response_cache.invalidate()
+                if minimal_response():
+                    return jsonify({
+                        'success': True,
+                        'created': question.id,
+                        'total_questions': question_index.count()
+                    })
 
-                questions = Question.query.order_by('id').all()
-                current_questions = my_page(request, questions)
+                questions = Question.query.order_by(Question.id)
+                current_questions, total_questions = my_page(request, questions)
                 return jsonify({
                     'success': True,
                     'created': question.id,
                     'questions': current_questions,
-                    'total_questions': len(questions)
+                    'total_questions': total_questions
                 })
 
 
         except:
             abort(422)
 
+    # delete many questions at once, body {"ids": [...]}, with one statement
+    # in one transaction and a result for each id
+    @app.route('/questions/batch', methods=[ 'DELETE' ])
+    def delete_user_questions():
+        body = request.get_json(silent=True) or {}
+        ids = batch_ids(body.get('ids'), app.config.get('BATCH_MAX_IDS', 1000))
+        if ids is None:
+            abort(400)
+        try:
+            results = delete_questions(ids)
+        except:
+            abort(422)
+        response_cache.invalidate()
+        return jsonify({
+            'success': True,
+            'deleted': sum(result[ 'status' ] == 'deleted' for result in results),
+            'results': results,
+            'total_questions': question_index.count()
+        })
+
+    # move many questions to a category and/or difficulty at once, body
+    # {"ids": [...], "category": 2, "difficulty": 3}
+    @app.route('/questions/batch', methods=[ 'PATCH' ])
+    def update_user_questions():
+        body = request.get_json(silent=True) or {}
+        ids = batch_ids(body.get('ids'), app.config.get('BATCH_MAX_IDS', 1000))
+        values = {field: body[ field ] for field in BATCH_UPDATE_FIELDS if field in body}
+        if ids is None or not values or not all(type(value) is int for value in values.values()):
+            abort(400)
+        if 'difficulty' in values and not valid_difficulty(values[ 'difficulty' ]):
+            abort(400)
+        if 'category' in values and not category_exists(values[ 'category' ]):
+            abort(422)
+        try:
+            results = update_questions(ids, values)
+        except:
+            abort(422)
+        response_cache.invalidate()
+        return jsonify({
+            'success': True,
+            'updated': sum(result[ 'status' ] == 'updated' for result in results),
+            'results': results
+        })
+
     # search all question from database with user's search_term and return results.
     @app.route('/questions/search', methods=[ 'POST' ])
+    @read_only
+    @admission.limited('search')
+    @response_cache.cached
     def search_question():
         body = request.get_json()
         search_term = body.get('searchTerm', None)
+        search_answers = body.get('searchAnswers', False) is True
 
-        search_term_formatted = '%' + search_term + '%'
         try:
-            questions = Question.query.filter(Question.question.ilike(search_term_formatted)).all()
-            questions_paged = my_page(request, questions)
-            total_results = len(questions)
+            start = page_start(request)
+            if not isinstance(search_term, str) or start is None:
+                abort(404)
+            questions, total_results = question_search.search(search_term, search_answers,
+                                                              start, QUESTIONS_PER_PAGE)
+            questions_paged = [ question.format() for question in questions ]
             if total_results:
                 return jsonify({
                     'success': True,
@@ -210,32 +519,130 @@ def create_app(test_config=None):
         except:
             abort(422)
 
+    # import many questions at once from ndjson (default) or csv (text/csv or
+    # ?format=csv) read from the request body as it streams in
+    @app.route('/questions/bulk', methods=[ 'POST' ])
+    def import_user_questions():
+        data_format = request.args.get('format', 'csv' if request.mimetype == 'text/csv' else 'ndjson')
+        if data_format not in ('ndjson', 'csv'):
+            abort(400)
+        lines = (line.decode('utf-8', 'replace') for line in request.stream)
+        report = import_questions(lines, data_format, category_exists,
+                                  app.config.get('BULK_BATCH_SIZE', 1000),
+                                  app.config.get('BULK_MAX_ERRORS', 100))
+        response_cache.invalidate()
+        return jsonify({
+            'success': True,
+            'inserted': report[ 'inserted' ],
+            'failed': report[ 'failed' ],
+            'errors': report[ 'errors' ]
+        })
+
+    # download the question bank as ndjson (default) or csv, optionally of one
+    # category and/or difficulty, streamed so memory stays flat whatever its size
+    @app.route('/questions/export', methods=[ 'GET' ])
+    @read_only
+    @conditional('questions', 'categories')
+    def export_user_questions():
+        data_format = request.args.get('format', 'ndjson')
+        category = request.args.get('category', None, type=int)
+        difficulty = request.args.get('difficulty', None, type=int)
+        if data_format not in ('ndjson', 'csv'):
+            abort(400)
+        if category is not None and category_registry.get(category) is None:
+            abort(404)
+
+        rows = export_rows(category, difficulty)
+        if data_format == 'csv':
+            chunks, mimetype = csv_chunks(rows), 'text/csv'
+        else:
+            chunks, mimetype = ndjson_chunks(rows), 'application/x-ndjson'
+        return Response(stream_with_context(chunks), mimetype=mimetype, headers={
+            'Content-Disposition': 'attachment; filename=questions.' + data_format
+        })
+
+    # hit, miss and eviction counters of the response cache
+    @app.route('/admin/cache', methods=[ 'GET' ])
+    def get_cache_stats():
+        return jsonify({
+            'success': True,
+            'cache': response_cache.stats()
+        })
+
+    # requests refused by the rate limits and concurrency caps
+    @app.route('/admin/limits', methods=[ 'GET' ])
+    def get_limit_stats():
+        return jsonify({
+            'success': True,
+            'limits': admission.stats()
+        })
+
+    # size, use and checkout wait counters of the database connection pool
+    @app.route('/admin/pool', methods=[ 'GET' ])
+    def get_pool_stats():
+        return jsonify({
+            'success': True,
+            'pool': pool_status(db.engine),
+            'replicas': replica_router.status()
+        })
+
+    # request, sql and cache metrics in the prometheus text format
+    @app.route('/metrics', methods=[ 'GET' ])
+    def get_metrics():
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    # last sql profiles, only while the profiler is turned on
+    @app.route('/_debug/queries', methods=[ 'GET' ])
+    def get_query_profiles():
+        if not (app.config.get('SQL_PROFILER') or app.config.get('SQL_PROFILER_HEADER')):
+            abort(404)
+        return jsonify({
+            'success': True,
+            'reports': list(profiler.reports)
+        })
+
+    # typeahead suggestions for the search box answered from memory
+    @app.route('/questions/suggest', methods=[ 'GET' ])
+    @read_only
+    def suggest_questions():
+        text = request.args.get('q', '')
+        limit = request.args.get('limit', 10, type=int)
+        if limit < 1 or limit > 50:
+            abort(400)
+        return jsonify({
+            'success': True,
+            'query': text,
+            'suggestions': suggest_index.suggest(text, limit)
+        })
+
     # Get all questions within a certain category and paginated
     @app.route('/category/questions', methods=[ 'POST' ])
+    @read_only
     def get_category_questions_per_page():
         # check if category is sent in request
         body = request.get_json()
         category = body.get('category', None)
+        cursor = request_cursor(request, body)
         if category is not None:
-            questions = Question.query.filter(Question.category == category).all()
+            questions = Question.query.filter(Question.category == category)
             if questions is not None:
-                page_questions = my_page(request, questions)
-                current_category_data = Category.query.get(category)
-                if current_category_data is not None:
-                    current_category = current_category_data.type
-                    categories = Category.query.all()
-                    category_names = [ ]
-                    for cat in categories:
-                        category_names.append(cat.type)
+                page_questions, total_questions, next_cursor = paginate(request, questions,
+                                                                        [ Question.id ], cursor)
+                current_category = category_registry.get(category)
+                if current_category is not None:
+                    category_names = category_registry.get_names()
 
                     if len(page_questions):
-                        return jsonify({
+                        response = {
                             'success': True,
                             'questions': page_questions,
-                            'total_category_questions': len(questions),
+                            'total_category_questions': total_questions,
                             'current_category': current_category,
                             'categories': category_names
-                        })
+                        }
+                        if cursor is not None:
+                            response[ 'next_cursor' ] = next_cursor
+                        return fast_response(response)
                     else:
                         abort(404)
                 else:
@@ -247,57 +654,134 @@ def create_app(test_config=None):
 
     # quiz game takes category and previous questions if exist and send next question
     @app.route('/category/quiz/questions', methods=[ 'POST' ])
+    @read_only
+    @admission.limited('quiz')
     def get_quiz_questions_per_category():
         # check if category & previous questions is sent in request
         body = request.get_json()
         category = body.get('category', None)
         previous_questions = body.get('previousQuestions', [])
+        difficulty = body.get('difficulty', None)
+
+        try:
+            played = set(int(question_id) for question_id in previous_questions)
+        except (TypeError, ValueError):
+            abort(400)
+        if difficulty is not None and not valid_difficulty(difficulty):
+            abort(400)
 
         if category is not None:
             if category != 'All':
-                current_category_data = Category.query.get(category)
-                if current_category_data is not None:
-                    current_category = current_category_data.type
-                    all_questions = Question.query.filter(Question.category == category).all()
-                else:
+                current_category = category_registry.get(category)
+                if current_category is None:
                     abort(404)
+                category_id = category
             else:
                 current_category = 'All'
-                all_questions = Question.query.order_by('category').all()
-            formatted_questions = [question.format() for question in all_questions]
-            if formatted_questions is not None:
-                all_questions_id = []
-                for ques in formatted_questions:
-                    all_questions_id.append(ques['id'])
-                quiz_question_id = 0
-                while quiz_question_id == 0:
-                    random_question = random.choice(all_questions_id)
-                    if str(random_question) not in previous_questions:
-                        quiz_question_id = random_question
-                    else:
-                        continue
-                quiz_question = Question.query.filter_by(id=quiz_question_id).one_or_none()
-                quiz_question_formatted = quiz_question.format()
-                if quiz_question:
-                    return jsonify({
-                        'success': True,
-                        'question': quiz_question_formatted,
-                        'total_category_questions': len(formatted_questions),
-                        'current_category': current_category,
-                    })
-
-                else:
-                    abort(404)
-
+                category_id = None
+            # question is None once every question of the category was played,
+            # with a difficulty the nearest one left is drawn
+            if difficulty is None:
+                quiz_question = question_index.draw(category_id, played)
             else:
-                abort(404)
+                quiz_question = question_index.draw_near(category_id, played, difficulty)
+            return jsonify({
+                'success': True,
+                'question': quiz_question.format() if quiz_question is not None else None,
+                'total_category_questions': len(question_index.get_ids(category_id)),
+                'current_category': current_category,
+            })
         else:
             abort(404)
 
+    # start a quiz session for a category (or All), the played questions are
+    # kept by the server so the client only sends the session id afterwards.
+    # an adaptive session follows the player's answers up and down the
+    # difficulties, starting at difficulty
+    @app.route('/quiz/sessions', methods=[ 'POST' ])
+    @admission.limited('quiz')
+    def start_quiz_session():
+        body = request.get_json(silent=True) or {}
+        category = body.get('category', None)
+        adaptive = body.get('adaptive', False)
+        difficulty = body.get('difficulty', ADAPTIVE_START_DIFFICULTY)
+
+        if category != 'All' and type(category) is not int:
+            abort(400)
+        if not isinstance(adaptive, bool) or not valid_difficulty(difficulty):
+            abort(400)
+        if category != 'All':
+            current_category = category_registry.get(category)
+            if current_category is None:
+                abort(404)
+            category_id = int(category)
+        else:
+            current_category = 'All'
+            category_id = None
+        session = quiz_sessions.create(category_id, current_category, adaptive, difficulty)
+        return jsonify({
+            'success': True,
+            'session_id': session.id,
+            'adaptive': session.adaptive,
+            'total_category_questions': len(question_index.get_ids(category_id)),
+            'current_category': current_category,
+        })
+
+    # next question of a quiz session, question is None once all were played.
+    # adaptive sessions take how the previous question went, as correct (bool)
+    # or the player's answer, before picking the difficulty of the next one
+    @app.route('/quiz/sessions/<session_id>/next', methods=[ 'POST' ])
+    @read_only
+    @admission.limited('quiz')
+    def get_quiz_session_question(session_id):
+        session = quiz_sessions.get(session_id)
+        if session is None:
+            abort(404)
+        body = request.get_json(silent=True) or {}
+        correct = body.get('correct', None)
+        answer = body.get('answer', None)
+        if (correct is not None and not isinstance(correct, bool)) or \
+                (answer is not None and not isinstance(answer, str)):
+            abort(400)
+
+        with session.lock:
+            if session.adaptive:
+                session.answered(correct, answer)
+                quiz_question = question_index.draw_near(session.category, session.played, session.difficulty)
+            else:
+                quiz_question = question_index.draw(session.category, session.played)
+            if quiz_question is not None:
+                session.played.add(quiz_question.id)
+                session.last_answer = quiz_question.answer
+            response = {
+                'success': True,
+                'session_id': session.id,
+                'question': quiz_question.format() if quiz_question is not None else None,
+                'played_questions': len(session.played),
+                'total_category_questions': len(question_index.get_ids(session.category)),
+                'current_category': session.current_category,
+            }
+            if session.adaptive:
+                response[ 'difficulty' ] = session.difficulty
+            return jsonify(response)
+
+    # end a quiz session
+    @app.route('/quiz/sessions/<session_id>', methods=[ 'DELETE' ])
+    def end_quiz_session(session_id):
+        if not quiz_sessions.delete(session_id):
+            abort(404)
+        return jsonify({
+            'success': True,
+            'deleted_session': session_id
+        })
 
     # ----------------------------------------------------------------------------#
     # Error Handlers.
     # ----------------------------------------------------------------------------#
+    def retry_after(error):
+        seconds = getattr(error, 'retry_after', None)
+        return {'Retry-After': str(seconds)} if seconds else {}
+
     @app.errorhandler(404)
     def not_found(error):
         return jsonify({
@@ -330,6 +814,30 @@ def create_app(test_config=None):
             "message": 'Bad Request!!!! Please make sure the data you entered is correct'
         }), 400
 
+    @app.errorhandler(413)
+    def payload_too_large(error):
+        return jsonify({
+            "success": False,
+            "error": 413,
+            "message": 'Payload Too Large!!!: The request body is too big'
+        }), 413
+
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        return jsonify({
+            "success": False,
+            "error": 429,
+            "message": 'Too Many Requests!!!: Please slow down and retry after a while'
+        }), 429, retry_after(error)
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify({
+            "success": False,
+            "error": 503,
+            "message": 'Service Unavailable!!!: The server is busy, please retry after a while'
+        }), 503, retry_after(error)
+
     @app.errorhandler(500)
     def not_found(error):
         return jsonify({
@@ -0,0 +1,201 @@
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import ClientDisconnected, RequestEntityTooLarge
+
+# ----------------------------------------------------------------------------#
+# ASGI serving mode.
+# The same flask app and routes served by an ASGI server (uvicorn, hypercorn):
+# request bodies are read and responses sent on the event loop, so slow
+# clients only hold a coroutine, and a view only takes one of the
+# ASGI_WORKERS threads while it is running. A view keeps its thread from start
+# to end since flask contexts and the sqlalchemy session are per thread.
+# Bodies over ASGI_BUFFER_SIZE (bulk imports) are not buffered: the view
+# pulls them from the client message by message as it reads wsgi.input.
+#   uvicorn --factory flaskr.asgi:create_asgi_app
+# ----------------------------------------------------------------------------#
+
+
+# read_body result when the client went away before sending the whole body
+DISCONNECTED = object()
+
+
+# wsgi.input of a body larger than ASGI_BUFFER_SIZE: the part read on the
+# event loop, then the rest received from the view's thread when it reads,
+# one message at a time, so the body is never held whole in memory. the
+# client leaving raises ClientDisconnected in the view and going over
+# MAX_CONTENT_LENGTH RequestEntityTooLarge
+class RequestBody(io.RawIOBase):
+
+    def __init__(self, head, receive, loop, max_body):
+        self.chunk = head
+        self.receive = receive
+        self.loop = loop
+        self.max_body = max_body
+        self.size = len(head)
+        self.more_body = True
+        self.disconnected = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunk and self.more_body:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message[ 'type' ] == 'http.disconnect':
+                self.disconnected = True
+                raise ClientDisconnected()
+            self.chunk = message.get('body', b'')
+            self.more_body = message.get('more_body', False)
+            self.size += len(self.chunk)
+            if self.max_body is not None and self.size > self.max_body:
+                raise RequestEntityTooLarge()
+        size = min(len(buffer), len(self.chunk))
+        buffer[ :size ] = self.chunk[ :size ]
+        self.chunk = self.chunk[ size: ]
+        return size
+
+
+# wsgi environ of an asgi http request scope, body is the whole body as
+# bytes or a RequestBody streaming it
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope[ 'method' ],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope[ 'path' ].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[ 0 ],
+        'SERVER_PORT': str(server[ 1 ]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': scope[ 'client' ][ 0 ] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', [ ]):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        if name in environ:
+            # cookies split over headers (http/2) join like a single cookie header
+            value = environ[ name ] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+        environ[ name ] = value
+    if isinstance(body, bytes):
+        # the body is already read whole, chunked requests included
+        environ[ 'wsgi.input' ] = io.BytesIO(body)
+        environ[ 'CONTENT_LENGTH' ] = str(len(body))
+    else:
+        environ[ 'wsgi.input' ] = io.BufferedReader(body)
+        # a chunked body ends where the client says so, not at a length
+        environ[ 'wsgi.input_terminated' ] = True
+    return environ
+
+
+class AsgiApp:
+
+    def __init__(self, app, workers=None):
+        self.app = app
+        self.max_body = app.config.get('MAX_CONTENT_LENGTH')
+        self.buffer_size = app.config.get('ASGI_BUFFER_SIZE', 64 * 1024)
+        self.executor = ThreadPoolExecutor(workers or app.config.get('ASGI_WORKERS', 15),
+                                           thread_name_prefix='asgi-view')
+
+    async def __call__(self, scope, receive, send):
+        if scope[ 'type' ] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope[ 'type' ] != 'http':
+            return
+        loop = asyncio.get_running_loop()
+        body = await self.read_body(receive, loop)
+        if body is DISCONNECTED:
+            # nobody is left to answer, and a view must not run on half a body
+            return
+        if body is None:
+            return await self.send_error(send, 413, 'Payload Too Large!!!: The request body is too big')
+        response = await loop.run_in_executor(self.executor, self.run_view,
+                                              build_environ(scope, body), send, loop)
+        if isinstance(body, RequestBody) and body.disconnected:
+            return
+        if response is not None:
+            status, headers, content = response
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': content})
+
+    # the body read without holding a thread: the whole of it up to
+    # ASGI_BUFFER_SIZE bytes, past that a RequestBody the view reads the rest
+    # from. None when over MAX_CONTENT_LENGTH, DISCONNECTED when the client
+    # left before the end of a buffered body
+    async def read_body(self, receive, loop):
+        chunks = [ ]
+        size = 0
+        while True:
+            message = await receive()
+            if message[ 'type' ] == 'http.disconnect':
+                return DISCONNECTED
+            chunks.append(message.get('body', b''))
+            size += len(chunks[ -1 ])
+            if self.max_body is not None and size > self.max_body:
+                return None
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+            if size >= self.buffer_size:
+                return RequestBody(b''.join(chunks), receive, loop, self.max_body)
+
+    # runs in a worker thread: a response with a known length is returned to
+    # be sent from the event loop, a streamed one is sent from here chunk by chunk
+    def run_view(self, environ, send, loop):
+        started = [ ]
+
+        def start_response(status, headers, exc_info=None):
+            started[ : ] = [ int(status.split(' ', 1)[ 0 ]),
+                             [ (name.lower().encode('latin-1'), value.encode('latin-1'))
+                               for name, value in headers ] ]
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        body = self.app(environ, start_response)
+        try:
+            status, headers = started
+            if any(name == b'content-length' for name, _ in headers):
+                return status, headers, b''.join(body)
+            send_from_thread({'type': 'http.response.start', 'status': status, 'headers': headers})
+            for chunk in body:
+                if chunk:
+                    send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_from_thread({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    async def send_error(self, send, status, message):
+        content = json.dumps({'success': False, 'error': status, 'message': message}).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [ (b'content-type', b'application/json'),
+                                 (b'content-length', str(len(content)).encode('latin-1')) ]})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message[ 'type' ] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message[ 'type' ] == 'lifespan.shutdown':
+                # off the loop, worker threads may still wait on it to send
+                # or read a body
+                await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+# factory for asgi servers, the same config as create_app
+def create_asgi_app(test_config=None):
+    from . import create_app
+    return AsgiApp(create_app(test_config))
@@ -0,0 +1,74 @@
+from models import db, Question, bump_generation, count_write, notify_question_observers
+from .serialize import ROW_FIELDS, question_rows
+
+# fields a batch update may set
+BATCH_UPDATE_FIELDS = ('category', 'difficulty')
+
+
+# ids of a batch request without duplicates, in the order sent, or None when
+# they are not a non empty list of at most max_ids integers
+def batch_ids(ids, max_ids):
+    if not isinstance(ids, list) or not ids or len(ids) > max_ids:
+        return None
+    if not all(type(question_id) is int for question_id in ids):
+        return None
+    return list(dict.fromkeys(ids))
+
+
+# ids of ?ids=1,2,3, None when malformed
+def parse_ids(text, max_ids):
+    try:
+        ids = [ int(question_id) for question_id in text.split(',') ]
+    except ValueError:
+        return None
+    return batch_ids(ids, max_ids)
+
+
+# 'ok' or 'not_found' for each id, in the order sent
+def id_results(ids, found, status):
+    return [ {'id': question_id, 'status': status if question_id in found else 'not_found'}
+             for question_id in ids ]
+
+
+# the questions of ids (in that order) with one SELECT, and the ids missing
+def fetch_questions(ids):
+    rows = question_rows(Question.query.filter(Question.id.in_(ids)))
+    questions = {row[ 0 ]: dict(zip(ROW_FIELDS, row)) for row in rows}
+    return [ questions[ question_id ] for question_id in ids if question_id in questions ], \
+           [ question_id for question_id in ids if question_id not in questions ]
+
+
+# delete the questions of ids with one DELETE in one transaction, the rows
+# are locked first so the per id results are what the DELETE removed
+def delete_questions(ids):
+    try:
+        found = { row[ 0 ] for row in db.session.query(Question.id).filter(Question.id.in_(ids)).with_for_update() }
+        if found:
+            Question.query.filter(Question.id.in_(found)).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if found:
+        count_write('questions')
+        bump_generation('questions')
+        notify_question_observers('reset', None)
+    return id_results(ids, found, 'deleted')
+
+
+# set values (category and/or difficulty) on the questions of ids with one
+# UPDATE in one transaction
+def update_questions(ids, values):
+    try:
+        found = { row[ 0 ] for row in db.session.query(Question.id).filter(Question.id.in_(ids)).with_for_update() }
+        if found:
+            Question.query.filter(Question.id.in_(found)).update(values, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if found:
+        count_write('questions')
+        bump_generation('questions')
+        notify_question_observers('reset', None)
+    return id_results(ids, found, 'updated')
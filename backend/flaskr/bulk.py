@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+from models import db, Question, bump_generation, count_write, notify_question_observers
+from .quiz import MIN_DIFFICULTY, MAX_DIFFICULTY
+
+# columns a question row needs, in the order rows are written
+QUESTION_FIELDS = ('question', 'answer', 'difficulty', 'category')
+
+
+# (line number, row dict) for every row of the lines, a row that can't be
+# parsed comes as (line number, None)
+def read_rows(lines, data_format):
+    if data_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+
+
+# values of a question row ready to insert, or the reason it is refused
+def validate_row(row, category_exists):
+    if row is None:
+        return None, 'not a question object'
+    values = {}
+    for field in ('question', 'answer'):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return None, field + ' is missing'
+        values[ field ] = value
+    for field in ('difficulty', 'category'):
+        value = row.get(field)
+        if isinstance(value, str) and value.strip().isdigit():
+            value = int(value)
+        if type(value) is not int:
+            return None, field + ' must be a number'
+        values[ field ] = value
+    if not MIN_DIFFICULTY <= values[ 'difficulty' ] <= MAX_DIFFICULTY:
+        return None, 'difficulty must be between %d and %d' % (MIN_DIFFICULTY, MAX_DIFFICULTY)
+    if not category_exists(values[ 'category' ]):
+        return None, 'category ' + str(values[ 'category' ]) + ' does not exist'
+    return values, None
+
+
+# write a batch in the open transaction, with COPY on postgres and a single
+# executemany INSERT elsewhere
+def write_batch(rows):
+    if db.engine.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([ row[ field ] for field in QUESTION_FIELDS ])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert('COPY questions (' + ', '.join(QUESTION_FIELDS) + ') FROM STDIN WITH (FORMAT csv)',
+                               buffer)
+        finally:
+            cursor.close()
+    else:
+        db.session.execute(Question.__table__.insert(), rows)
+
+
+# import questions from lines of ndjson (one object per line) or csv (with a
+# header), batch_size rows per transaction. rows that don't validate are
+# reported and skipped without failing their batch, a batch the database
+# refuses is retried row by row to find the rows at fault.
+def import_questions(lines, data_format, category_exists, batch_size=1000, max_errors=100):
+    report = {'inserted': 0, 'failed': 0, 'errors': [ ]}
+
+    def fail(line_number, error):
+        report[ 'failed' ] += 1
+        if len(report[ 'errors' ]) < max_errors:
+            report[ 'errors' ].append({'line': line_number, 'error': error})
+
+    def flush(batch):
+        try:
+            write_batch([ values for line_number, values in batch ])
+            db.session.commit()
+            report[ 'inserted' ] += len(batch)
+        except Exception:
+            db.session.rollback()
+            if len(batch) == 1:
+                fail(batch[ 0 ][ 0 ], 'refused by the database')
+            else:
+                for row in batch:
+                    flush([ row ])
+            return
+        count_write('questions')
+        bump_generation('questions')
+        notify_question_observers('reset', None)
+
+    batch = [ ]
+    for line_number, row in read_rows(lines, data_format):
+        values, error = validate_row(row, category_exists)
+        if error is not None:
+            fail(line_number, error)
+            continue
+        batch.append((line_number, values))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = [ ]
+    if batch:
+        flush(batch)
+    return report
@@ -0,0 +1,131 @@
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g, request, make_response
+from models import generation
+from .serialize import negotiate
+
+
+# bounded in-process cache, least recently used entries are evicted past
+# maxsize and entries expire ttl seconds after they were stored. any object
+# with the same get/set/clear/stats methods can replace it (see
+# RESPONSE_CACHE_BACKEND), e.g. one shared by all the server processes.
+class LRUCache:
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[ 0 ] <= time.monotonic():
+                del self.entries[ key ]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[ 1 ]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[ key ] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+
+# caches the body of successful responses of read views, keyed by endpoint,
+# normalized arguments, json body, negotiated response type and the versions
+# of tables. the backend is cleared when a write moves the generation of one
+# of tables, or its version shared by all the processes (the one ETags are
+# made from, see TableVersions) for the writes of other processes, and by
+# invalidate() after writes. bodies read from a replica, which may lag the
+# primary, are not stored and the requests of a client that just wrote
+# (reading from the primary, see ReplicaRouter) skip the cache.
+class ResponseCache:
+
+    def __init__(self, backend, tables=('questions', 'categories')):
+        self.backend = backend
+        self.tables = tables
+        self.seen_versions = None
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        self.backend.clear()
+
+    def versions(self):
+        shared = current_app.extensions.get('table_versions')
+        return [ [ generation(table), shared.get(table) if shared is not None else None ]
+                 for table in self.tables ]
+
+    # versions of tables, the backend is cleared when they moved. they are
+    # part of the key too so a body read before a write, stored after the
+    # clear, is never answered for the data after it
+    def check_versions(self):
+        current = self.versions()
+        if current != self.seen_versions:
+            with self.lock:
+                if current != self.seen_versions:
+                    self.backend.clear()
+                    self.seen_versions = current
+        return current
+
+    @staticmethod
+    def request_key(versions):
+        key = [ request.endpoint, sorted(request.args.items(multi=True)), negotiate(), versions ]
+        if request.method != 'GET':
+            body = request.get_json(silent=True)
+            key.append(body if body is not None else request.get_data(as_text=True))
+        return json.dumps(key, sort_keys=True)
+
+    def cached(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if current_app.extensions[ 'replica_router' ].sticky():
+                return view(*args, **kwargs)
+            key = self.request_key(self.check_versions())
+            entry = self.backend.get(key)
+            if entry is not None:
+                data, mimetype = entry
+                response = make_response(data)
+                response.mimetype = mimetype
+                response.vary.add('Accept')
+                response.headers[ 'X-Cache' ] = 'HIT'
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed and not g.get('replica_read'):
+                self.backend.set(key, (response.get_data(), response.mimetype))
+            response.headers[ 'X-Cache' ] = 'MISS'
+            return response
+        return wrapper
+
+    def stats(self):
+        return self.backend.stats()
@@ -0,0 +1,42 @@
+from models import Category
+from .tracked import TrackedTable
+
+
+# in-memory copy of the categories table, categories almost never change so
+# the listing endpoints read them from here instead of querying every request.
+# it reloads itself when the categories write generation moves.
+class CategoryRegistry(TrackedTable):
+
+    model = Category
+
+    def __init__(self):
+        super().__init__()
+        self.types = {}
+        self.names = []
+
+    def read(self):
+        return Category.query.order_by(Category.id).all()
+
+    def install(self, categories):
+        self.types = {cat.id: cat.type for cat in categories}
+        self.names = list(self.types.values())
+
+    # type of a category id (int or numeric string), None if it doesn't exist.
+    # anything else int() would take (True, 1.7) is no category id
+    def get(self, category_id):
+        self.refresh()
+        if isinstance(category_id, str) and category_id.strip().isdigit():
+            category_id = int(category_id)
+        if type(category_id) is not int:
+            return None
+        return self.types.get(category_id)
+
+    # category names ordered by id
+    def get_names(self):
+        self.refresh()
+        return self.names
+
+    # categories formatted like Category.format() ordered by id
+    def get_all(self):
+        self.refresh()
+        return [ {'id': category_id, 'type': category_type} for category_id, category_type in self.types.items() ]
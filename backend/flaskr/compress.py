@@ -0,0 +1,77 @@
+import zlib
+from flask import request
+
+# brotli is optional, only gzip is offered without it
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# types worth compressing, images and the like already are
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/msgpack', 'application/x-msgpack',
+                      'text/csv', 'text/plain', 'text/html')
+
+
+# content coding the client accepts that we can send, brotli first, None
+# when it accepts neither
+def choose_encoding():
+    offered = ('br', 'gzip') if brotli is not None else ('gzip',)
+    return request.accept_encodings.best_match(offered)
+
+
+def compressor(encoding, config):
+    if encoding == 'br':
+        return brotli.Compressor(quality=config.get('COMPRESS_BR_LEVEL', 4))
+    # wbits 16 + MAX_WBITS writes the gzip header and trailer
+    return zlib.compressobj(config.get('COMPRESS_LEVEL', 6), zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+# compressed chunks of a streamed body, each chunk is flushed so clients
+# get the rows as they are produced
+def compress_chunks(chunks, encoding, config):
+    engine = compressor(encoding, config)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if encoding == 'br':
+                data = engine.process(chunk) + engine.flush()
+            else:
+                data = engine.compress(chunk) + engine.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield engine.finish() if encoding == 'br' else engine.flush()
+    finally:
+        # ends the wrapped stream (and its request context) with this one
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+# after_request hook: compress the body with the coding negotiated from
+# Accept-Encoding when the type is compressible, bodies under
+# COMPRESS_MIN_SIZE bytes are sent as they are. streamed bodies (exports)
+# are compressed chunk by chunk
+def compress_response(response, config):
+    if not config.get('COMPRESS', True) or response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if response.direct_passthrough or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding, config)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config.get('COMPRESS_MIN_SIZE', 1024):
+            return response
+        engine = compressor(encoding, config)
+        if encoding == 'br':
+            response.set_data(engine.process(data) + engine.finish())
+        else:
+            response.set_data(engine.compress(data) + engine.flush())
+    response.headers[ 'Content-Encoding' ] = encoding
+    return response
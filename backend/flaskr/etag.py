@@ -0,0 +1,46 @@
+import functools
+from flask import current_app, request, make_response
+from .serialize import negotiate
+
+
+# version of the data read from tables, moves with every write to one of them.
+# made from the table versions shared by all the processes (TableVersions) so
+# every worker gives the same tag to the same data. a request reading from a
+# replica gets the versions of that replica, which may lag the primary. None
+# (no tag) when the versions can't be read, e.g. the database has no
+# table_versions, since the writes of other processes would go unseen. json
+# and msgpack bodies of the same data get different tags
+def data_etag(tables):
+    versions = current_app.extensions[ 'table_versions' ]
+    if current_app.extensions[ 'replica_router' ].replica_engine() is not None:
+        replica_versions = versions.read() if versions.available() else {}
+        shared = [ replica_versions.get(table) for table in tables ]
+    else:
+        shared = [ versions.get(table) for table in tables ]
+    if None in shared:
+        return None
+    tag = 'v' + '-'.join(str(version) for version in shared)
+    return tag if negotiate() == 'application/json' else tag + '-msgpack'
+
+
+# decorator for GET views that only read tables, the response gets a weak
+# ETag from their versions (data_etag) and a request sending it back in
+# If-None-Match is answered 304 before the view (and its queries) runs.
+# writes made by other processes are seen within INDEX_PROBE_SECONDS.
+def conditional(*tables):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = data_etag(tables)
+            if etag is None:
+                return view(*args, **kwargs)
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            return response
+        return wrapper
+    return decorator
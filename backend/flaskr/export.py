@@ -0,0 +1,49 @@
+import csv
+import io
+from models import db, Question
+from .serialize import dumps
+
+# columns of an exported question, in csv order
+EXPORT_FIELDS = ('id', 'question', 'answer', 'difficulty', 'category')
+# rows fetched from the server side cursor and sent per chunk
+EXPORT_CHUNK_SIZE = 1000
+
+
+# question rows as plain tuples read through a server side cursor
+# (stream_results), yield_per rows at a time whatever the table size
+def export_rows(category=None, difficulty=None):
+    query = db.session.query(Question.id, Question.question, Question.answer,
+                             Question.difficulty, Question.category)
+    if category is not None:
+        query = query.filter(Question.category == category)
+    if difficulty is not None:
+        query = query.filter(Question.difficulty == difficulty)
+    return query.order_by(Question.id).yield_per(EXPORT_CHUNK_SIZE)
+
+
+# one json object per line, sent EXPORT_CHUNK_SIZE lines per chunk
+def ndjson_chunks(rows):
+    lines = [ ]
+    for row in rows:
+        lines.append(dumps(dict(zip(EXPORT_FIELDS, row))))
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield b'\n'.join(lines) + b'\n'
+            lines = [ ]
+    if lines:
+        yield b'\n'.join(lines) + b'\n'
+
+
+# csv with a header line, sent EXPORT_CHUNK_SIZE lines per chunk
+def csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
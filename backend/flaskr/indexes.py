@@ -0,0 +1,56 @@
+from sqlalchemy import func
+from models import db, Question, Category
+
+# indexes of migration 9b2f6c1d7e45
+CATEGORY_ID_INDEX = 'ix_questions_category_id'
+CATEGORY_DIFFICULTY_INDEX = 'ix_questions_category_difficulty'
+
+
+# the queries the listing, quiz and export endpoints run the most, shaped
+# like theirs, with the indexes any of which their plan should use
+def hot_queries(category, difficulty=1):
+    by_category = Question.query.filter(Question.category == category)
+    return [
+        ('category page', by_category.order_by(Question.id).limit(10).offset(10),
+         (CATEGORY_ID_INDEX,)),
+        ('category cursor page', by_category.filter(Question.id > 0).order_by(Question.id).limit(11),
+         (CATEGORY_ID_INDEX,)),
+        ('questions page', Question.query.order_by(Question.category, Question.id).limit(10).offset(10),
+         (CATEGORY_ID_INDEX,)),
+        ('category count', db.session.query(func.count(Question.id)).filter(Question.category == category),
+         (CATEGORY_ID_INDEX, CATEGORY_DIFFICULTY_INDEX)),
+        ('category difficulty', by_category.filter(Question.difficulty == difficulty).order_by(Question.id),
+         (CATEGORY_DIFFICULTY_INDEX, CATEGORY_ID_INDEX)),
+    ]
+
+
+# plan of a statement as text, EXPLAIN on postgres, EXPLAIN QUERY PLAN on sqlite
+def explain(connection, sql):
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.dialect.name == 'sqlite' else 'EXPLAIN '
+    return '\n'.join(' '.join(str(value) for value in row) for row in connection.execute(prefix + sql))
+
+
+# explain every hot query and tell whether its plan uses one of its indexes.
+# sequential scans are turned off for the check (postgres prefers them on
+# small tables), so it verifies an index exists that the planner can use
+def check_indexes():
+    category = db.session.query(func.min(Category.id)).scalar() or 1
+    results = [ ]
+    with db.engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            if connection.dialect.name == 'postgresql':
+                connection.execute('SET LOCAL enable_seqscan = off')
+            for name, query, indexes in hot_queries(category):
+                sql = str(query.statement.compile(dialect=connection.dialect,
+                                                  compile_kwargs={'literal_binds': True}))
+                plan = explain(connection, sql)
+                results.append({
+                    'query': name,
+                    'index': next((index for index in indexes if index in plan), None),
+                    'expected': indexes,
+                    'plan': plan
+                })
+        finally:
+            transaction.rollback()
+    return results
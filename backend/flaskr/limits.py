@@ -0,0 +1,121 @@
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import request
+from werkzeug.exceptions import TooManyRequests, ServiceUnavailable
+
+
+# token bucket per client: rate tokens a second up to burst, one token per
+# request. the least recently seen clients are dropped past max_clients so
+# the buckets of a burst of addresses don't grow without bound.
+class TokenBuckets:
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    # 0 when the client may go on, otherwise the seconds until its next token
+    def take(self, client, now):
+        with self.lock:
+            tokens, last = self.buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            self.buckets[ client ] = (tokens - 1 if not wait else tokens, now)
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+            return wait
+
+
+# admission control of the endpoints marked limited(name): each client gets
+# RATE_LIMITS[name]['rate'] requests a second (with 'burst' at once) and at
+# most 'concurrency' requests of the endpoint run together in this process.
+# requests past either are refused at once, 429 or 503 with Retry-After,
+# rather than waiting for a database connection. an endpoint missing from
+# RATE_LIMITS is not limited, settings are read on first use.
+class Admission:
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.running = {}
+        self.shed = {}
+        app.extensions[ 'admission' ] = self
+
+    def settings(self, name):
+        return self.app.config.get('RATE_LIMITS', {}).get(name)
+
+    def bucket(self, name, settings):
+        with self.lock:
+            if name not in self.buckets:
+                self.buckets[ name ] = TokenBuckets(settings[ 'rate' ], settings[ 'burst' ],
+                                                    self.app.config.get('RATE_LIMIT_CLIENTS', 10000))
+            return self.buckets[ name ]
+
+    def refuse(self, name, reason):
+        with self.lock:
+            self.shed[ (name, reason) ] = self.shed.get((name, reason), 0) + 1
+
+    # take a token and a running slot, False for the slot when the endpoint is full
+    def admit(self, name, settings):
+        if 'rate' in settings:
+            wait = self.bucket(name, settings).take(request.remote_addr, time.monotonic())
+            if wait:
+                self.refuse(name, 'rate')
+                raise TooManyRequests(retry_after=max(1, math.ceil(wait)))
+        if 'concurrency' in settings:
+            with self.lock:
+                if self.running.get(name, 0) >= settings[ 'concurrency' ]:
+                    full = True
+                else:
+                    full = False
+                    self.running[ name ] = self.running.get(name, 0) + 1
+            if full:
+                self.refuse(name, 'concurrency')
+                raise ServiceUnavailable(retry_after=1)
+            return True
+        return False
+
+    def release(self, name):
+        with self.lock:
+            self.running[ name ] -= 1
+
+    def limited(self, name):
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                settings = self.settings(name)
+                if not settings:
+                    return view(*args, **kwargs)
+                if not self.admit(name, settings):
+                    return view(*args, **kwargs)
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release(name)
+            return wrapper
+        return decorator
+
+    # prometheus lines of the shed requests and of the requests running
+    def metric_lines(self):
+        with self.lock:
+            lines = [ '# TYPE trivia_shed_total counter' ]
+            lines += [ 'trivia_shed_total{endpoint="%s",reason="%s"} %d' % (name, reason, count)
+                       for (name, reason), count in sorted(self.shed.items()) ]
+            lines.append('# TYPE trivia_admitted_running gauge')
+            lines += [ 'trivia_admitted_running{endpoint="%s"} %d' % (name, count)
+                       for name, count in sorted(self.running.items()) ]
+        return lines
+
+    def stats(self):
+        with self.lock:
+            return {
+                'shed': [ {'endpoint': name, 'reason': reason, 'count': count}
+                          for (name, reason), count in sorted(self.shed.items()) ],
+                'running': dict(self.running)
+            }
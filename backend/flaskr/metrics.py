@@ -0,0 +1,137 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# histogram upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [ 0 ] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[ bisect_left(self.buckets, value) ] += 1
+        self.sum += value
+        self.count += 1
+
+    # prometheus lines of the histogram, bucket counts are cumulative
+    def lines(self, name, labels):
+        lines = [ ]
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+        lines.append('%s_sum{%s} %s' % (name, labels, self.sum))
+        lines.append('%s_count{%s} %d' % (name, labels, self.count))
+        return lines
+
+
+# count the statements and rows of the request being served, registered once
+# for every engine
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries += 1
+        if cursor.rowcount > 0 and statement.lstrip()[ :6 ].upper() == 'SELECT':
+            g.metrics_rows += cursor.rowcount
+
+
+# per endpoint latency, sql statements, rows and response size of the
+# requests, shown in the prometheus text format. the request hooks only read
+# a clock and add to a few counters under one lock.
+class Metrics:
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.queries = {}
+        self.response_size = {}
+        self.rows = {}
+        # functions returning more prometheus lines (cache, pool...)
+        self.collectors = [ ]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not event.contains(Engine, 'after_cursor_execute', count_query):
+            event.listen(Engine, 'after_cursor_execute', count_query)
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+        app.teardown_request(self.teardown_request)
+        app.extensions[ 'metrics' ] = self
+
+    def start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_rows = 0
+
+    def end_request(self, response):
+        if 'metrics_start' in g:
+            self.record(response.status_code, response.calculate_content_length())
+        return response
+
+    # a request whose exception escaped the error handlers (propagated in
+    # debug mode) never reaches end_request, it is counted as a 500 here
+    def teardown_request(self, error):
+        if 'metrics_start' in g:
+            self.record(500, None)
+
+    def record(self, status, size):
+        duration = time.perf_counter() - g.pop('metrics_start')
+        endpoint = request.endpoint or 'unmatched'
+        with self.lock:
+            key = (endpoint, request.method, status)
+            self.requests[ key ] = self.requests.get(key, 0) + 1
+            if endpoint not in self.latency:
+                self.latency[ endpoint ] = Histogram(LATENCY_BUCKETS)
+                self.queries[ endpoint ] = Histogram(QUERY_BUCKETS)
+                self.response_size[ endpoint ] = Histogram(SIZE_BUCKETS)
+                self.rows[ endpoint ] = 0
+            self.latency[ endpoint ].observe(duration)
+            self.queries[ endpoint ].observe(g.metrics_queries)
+            self.rows[ endpoint ] += g.metrics_rows
+            # streamed responses have no length known here
+            if size is not None:
+                self.response_size[ endpoint ].observe(size)
+
+    def render(self):
+        lines = [ ]
+        with self.lock:
+            lines += [ '# HELP trivia_requests_total Requests served.',
+                       '# TYPE trivia_requests_total counter' ]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append('trivia_requests_total{endpoint="%s",method="%s",status="%d"} %d'
+                             % (endpoint, method, status, count))
+            for name, help_text, histograms in (
+                    ('trivia_request_duration_seconds', 'Time to answer a request.', self.latency),
+                    ('trivia_request_queries', 'SQL statements run by a request.', self.queries),
+                    ('trivia_response_size_bytes', 'Size of the response bodies.', self.response_size)):
+                lines += [ '# HELP %s %s' % (name, help_text), '# TYPE %s histogram' % name ]
+                for endpoint, histogram in sorted(histograms.items()):
+                    lines += histogram.lines(name, 'endpoint="%s"' % endpoint)
+            lines += [ '# HELP trivia_db_rows_total Rows returned by SELECT statements.',
+                       '# TYPE trivia_db_rows_total counter' ]
+            for endpoint, rows in sorted(self.rows.items()):
+                lines.append('trivia_db_rows_total{endpoint="%s"} %d' % (endpoint, rows))
+        for collector in self.collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
+
+
+# prometheus gauges of the numbers of a stats dict, named prefix_key
+def stats_lines(prefix, stats):
+    lines = [ ]
+    for key, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines += [ '# TYPE %s_%s gauge' % (prefix, key), '%s_%s %s' % (prefix, key, value) ]
+    return lines
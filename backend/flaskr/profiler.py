@@ -0,0 +1,162 @@
+import json
+import re
+import time
+from collections import deque
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# longest statement or parameters text kept in a report
+PROFILER_TEXT_LENGTH = 500
+
+LIMIT = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+WHERE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+AGGREGATE = re.compile(r'\b(count|sum|min|max|avg)\s*\(', re.IGNORECASE)
+
+
+def shorten(text):
+    return text if len(text) <= PROFILER_TEXT_LENGTH else text[ :PROFILER_TEXT_LENGTH ] + '...'
+
+
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('profiler_statements') is not None:
+        conn.info.setdefault('profiler_starts', [ ]).append(time.perf_counter())
+
+
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('profiler_statements') is not None:
+        starts = conn.info.get('profiler_starts')
+        if not starts:
+            return
+        g.profiler_statements.append({
+            'sql': statement,
+            'parameters': parameters,
+            'duration_ms': (time.perf_counter() - starts.pop()) * 1000,
+            'rows': cursor.rowcount
+        })
+
+
+# a statement that raised never reaches end_statement, its start is dropped
+# here so it isn't left on the connection
+def failed_statement(context):
+    if context.connection is not None:
+        starts = context.connection.info.get('profiler_starts')
+        if starts:
+            starts.pop()
+
+
+# a SELECT that loads rows without LIMIT, with no WHERE (a whole table) or
+# more than max_rows rows when the driver reports them
+def is_unbounded(statement, max_rows):
+    sql = statement[ 'sql' ]
+    if not sql.lstrip()[ :6 ].upper() == 'SELECT' or LIMIT.search(sql) or AGGREGATE.search(sql):
+        return False
+    return not WHERE.search(sql) or statement[ 'rows' ] > max_rows
+
+
+# opt-in profiler of the SQL run by each request, for SQL_PROFILER = True or,
+# with SQL_PROFILER_HEADER = True, requests sending X-Profile-Queries: 1.
+# a report lists every statement with its time and flags statements run
+# more than once with the same parameters (duplicates), the same statement
+# run SQL_PROFILER_REPEAT times or more with other parameters (N+1 loops),
+# unbounded SELECTs and the ones slower than SQL_PROFILER_SLOW_MS (explained
+# when SQL_PROFILER_EXPLAIN is set). reports go to the app log and the last
+# ones are listed by GET /_debug/queries.
+class QueryProfiler:
+
+    def __init__(self, app, engine_getter):
+        self.app = app
+        self.get_engine = engine_getter
+        self.reports = deque(maxlen=app.config.get('SQL_PROFILER_REPORTS', 50))
+        if not event.contains(Engine, 'before_cursor_execute', start_statement):
+            event.listen(Engine, 'before_cursor_execute', start_statement)
+            event.listen(Engine, 'after_cursor_execute', end_statement)
+            event.listen(Engine, 'handle_error', failed_statement)
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+
+    def wanted(self):
+        if request.path.startswith('/_debug/'):
+            return False
+        if self.app.config.get('SQL_PROFILER', False):
+            return True
+        return self.app.config.get('SQL_PROFILER_HEADER', False) and \
+            request.headers.get('X-Profile-Queries') == '1'
+
+    def start_request(self):
+        if self.wanted():
+            g.profiler_start = time.perf_counter()
+            g.profiler_statements = [ ]
+
+    def end_request(self, response):
+        statements = g.get('profiler_statements')
+        if statements is None:
+            return response
+        g.profiler_statements = None
+        report = self.analyse(statements)
+        report.update({
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - g.profiler_start) * 1000, 3)
+        })
+        self.reports.appendleft(report)
+        self.app.logger.info('sql profile %s', json.dumps(report, default=str))
+        response.headers[ 'X-SQL-Queries' ] = str(len(statements))
+        return response
+
+    def analyse(self, statements):
+        slow_ms = self.app.config.get('SQL_PROFILER_SLOW_MS', 100)
+        repeat = self.app.config.get('SQL_PROFILER_REPEAT', 3)
+        max_rows = self.app.config.get('SQL_PROFILER_MAX_ROWS', 100)
+        runs = {}
+        calls = {}
+        for statement in statements:
+            key = (statement[ 'sql' ], repr(statement[ 'parameters' ]))
+            runs[ key ] = runs.get(key, 0) + 1
+            calls.setdefault(statement[ 'sql' ], set()).add(key[ 1 ])
+        slow = [ statement for statement in statements if statement[ 'duration_ms' ] >= slow_ms ]
+        if self.app.config.get('SQL_PROFILER_EXPLAIN', False):
+            for statement in slow:
+                statement[ 'plan' ] = self.explain(statement)
+        return {
+            'count': len(statements),
+            'sql_ms': round(sum(statement[ 'duration_ms' ] for statement in statements), 3),
+            'statements': [ self.format(statement) for statement in statements ],
+            'duplicates': [ {'sql': shorten(sql), 'parameters': shorten(parameters), 'count': count}
+                            for (sql, parameters), count in runs.items() if count > 1 ],
+            'repeated': [ {'sql': shorten(sql), 'count': len(parameters)}
+                          for sql, parameters in calls.items() if len(parameters) >= repeat ],
+            'unbounded': [ shorten(statement[ 'sql' ]) for statement in statements
+                           if is_unbounded(statement, max_rows) ],
+            'slow': [ self.format(statement) for statement in slow ]
+        }
+
+    @staticmethod
+    def format(statement):
+        formatted = {
+            'sql': shorten(statement[ 'sql' ]),
+            'parameters': shorten(repr(statement[ 'parameters' ])),
+            'duration_ms': round(statement[ 'duration_ms' ], 3),
+            'rows': statement[ 'rows' ]
+        }
+        if 'plan' in statement:
+            formatted[ 'plan' ] = statement[ 'plan' ]
+        return formatted
+
+    # query plan of a SELECT, asked on a connection of its own
+    def explain(self, statement):
+        if not statement[ 'sql' ].lstrip()[ :6 ].upper() == 'SELECT':
+            return None
+        engine = self.get_engine()
+        prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(prefix + statement[ 'sql' ], statement[ 'parameters' ])
+            return [ ' '.join(str(column) for column in row) for row in cursor.fetchall() ]
+        except Exception as error:
+            return [ 'explain failed: %s' % error ]
+        finally:
+            connection.close()
@@ -0,0 +1,250 @@
+import random
+import secrets
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+from models import db, Question
+from .replicas import on_primary
+from .tracked import TrackedTable
+
+# random picks tried before falling back to listing the unplayed ids
+QUIZ_DRAW_TRIES = 8
+# question difficulties, and the level adaptive quizzes start at
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+ADAPTIVE_START_DIFFICULTY = 2
+# right answers in a row that move an adaptive quiz a level up
+ADAPTIVE_WINDOW = 3
+# category of the difficulty buckets of every question, not None which is
+# the category of questions whose category was deleted
+ALL_CATEGORIES = object()
+
+
+# draw an id uniformly from the ids that are not in played (anything
+# supporting `in` and len()), None when every id has been played.
+# while less than half the ids are played a few random picks almost always
+# land on an unplayed one, otherwise the unplayed ids are listed once, so
+# a draw never costs more than one pass over the category.
+def draw_question_id(ids, played):
+    if len(played) < len(ids) // 2:
+        for _ in range(QUIZ_DRAW_TRIES):
+            question_id = random.choice(ids)
+            if question_id not in played:
+                return question_id
+    remaining = [ question_id for question_id in ids if question_id not in played ]
+    if not remaining:
+        return None
+    return random.choice(remaining)
+
+
+# remove value from a sorted list, False if it wasn't there
+def remove_sorted(values, value):
+    position = bisect_left(values, value)
+    if position < len(values) and values[ position ] == value:
+        del values[ position ]
+        return True
+    return False
+
+
+# ids of every question grouped by category and by (category, difficulty)
+# (category ALL_CATEGORIES for all categories), loaded with a single narrow query and
+# reloaded when the questions write generation moves. the quiz draws from
+# here so a question costs one primary key lookup instead of a category scan.
+class QuestionIndex(TrackedTable):
+
+    model = Question
+
+    def __init__(self):
+        super().__init__()
+        self.all_ids = []
+        self.category_ids = {}
+        self.difficulty_ids = {}
+
+    def read(self):
+        return db.session.query(Question.id, Question.category, Question.difficulty).order_by(Question.id).all()
+
+    def install(self, rows):
+        all_ids = []
+        category_ids = {}
+        difficulty_ids = {}
+        for question_id, category, difficulty in rows:
+            all_ids.append(question_id)
+            category_ids.setdefault(category, []).append(question_id)
+            difficulty_ids.setdefault((category, difficulty), []).append(question_id)
+            difficulty_ids.setdefault((ALL_CATEGORIES, difficulty), []).append(question_id)
+        self.all_ids = all_ids
+        self.category_ids = category_ids
+        self.difficulty_ids = difficulty_ids
+
+    # inserts and deletes are patched in place, an update may have moved the
+    # question to other buckets so it is left to the next reload. an insert
+    # already in the index was read by a load racing with the write, the
+    # index is then reloaded rather than listing the id twice
+    def patch(self, event, question):
+        if event not in ('insert', 'delete'):
+            return False
+        position = bisect_left(self.all_ids, question.id)
+        if event == 'insert' and position < len(self.all_ids) and self.all_ids[ position ] == question.id:
+            return False
+        buckets = [ self.all_ids, self.category_ids.setdefault(question.category, [ ]),
+                    self.difficulty_ids.setdefault((question.category, question.difficulty), [ ]),
+                    self.difficulty_ids.setdefault((ALL_CATEGORIES, question.difficulty), [ ]) ]
+        if event == 'insert':
+            for ids in buckets:
+                insort(ids, question.id)
+            return True
+        return all([ remove_sorted(ids, question.id) for ids in buckets ])
+
+    # number of questions
+    def count(self):
+        return len(self.get_ids())
+
+    # ids of a category, or of every question when category is None, only
+    # those of a difficulty when one is given
+    def get_ids(self, category=None, difficulty=None):
+        self.refresh()
+        if difficulty is not None:
+            return self.difficulty_ids.get((ALL_CATEGORIES if category is None else int(category), difficulty), [])
+        if category is None:
+            return self.all_ids
+        return self.category_ids.get(int(category), [])
+
+    # random question of a category (and difficulty) that is not in played,
+    # None once those are exhausted
+    def draw(self, category, played, difficulty=None):
+        ids = self.get_ids(category, difficulty)
+        while True:
+            question_id = draw_question_id(ids, played)
+            if question_id is None:
+                return None
+            question = Question.query.get(question_id)
+            if question is None:
+                # maybe not on the replica yet
+                with on_primary():
+                    question = Question.query.get(question_id)
+            if question is not None:
+                return question
+            # deleted by another worker since the index was loaded
+            self.load()
+            ids = self.get_ids(category, difficulty)
+
+    # random question as close to difficulty as the unplayed ones allow,
+    # nearest difficulties first and the easier one on a tie, then those
+    # without a difficulty
+    def draw_near(self, category, played, difficulty):
+        for level in sorted(range(MIN_DIFFICULTY, MAX_DIFFICULTY + 1),
+                            key=lambda level: (abs(level - difficulty), level)):
+            question = self.draw(category, played, level)
+            if question is not None:
+                return question
+        return self.draw(category, played)
+
+
+# difficulty of the next question of an adaptive quiz from the recent
+# answers: up a level after ADAPTIVE_WINDOW right answers in a row, down
+# after two wrong ones in a row, the same level otherwise
+def next_difficulty(difficulty, recent):
+    if len(recent) >= ADAPTIVE_WINDOW and all(list(recent)[ -ADAPTIVE_WINDOW: ]):
+        recent.clear()
+        return min(difficulty + 1, MAX_DIFFICULTY)
+    if len(recent) >= 2 and not any(list(recent)[ -2: ]):
+        recent.clear()
+        return max(difficulty - 1, MIN_DIFFICULTY)
+    return difficulty
+
+
+# questions played in a quiz session as a sorted array of their ids, 4 bytes
+# an id and only as many as the session played
+class PlayedQuestions:
+
+    def __init__(self):
+        self.ids = array('i')
+
+    def add(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        if position == len(self.ids) or self.ids[ position ] != question_id:
+            self.ids.insert(position, question_id)
+
+    def __contains__(self, question_id):
+        position = bisect_left(self.ids, question_id)
+        return position < len(self.ids) and self.ids[ position ] == question_id
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# an adaptive session also keeps the current difficulty, the answer of the
+# last question sent and whether the recent answers were right
+class QuizSession:
+
+    def __init__(self, session_id, category, current_category, expires_at, adaptive=False,
+                 difficulty=ADAPTIVE_START_DIFFICULTY):
+        self.id = session_id
+        self.category = category
+        self.current_category = current_category
+        self.played = PlayedQuestions()
+        self.expires_at = expires_at
+        self.lock = threading.Lock()
+        self.adaptive = adaptive
+        self.difficulty = difficulty
+        self.last_answer = None
+        self.recent = deque(maxlen=ADAPTIVE_WINDOW)
+
+    # record whether the last question sent was answered right, from the
+    # client's verdict or by comparing its answer, and move the difficulty
+    def answered(self, correct=None, answer=None):
+        if self.last_answer is None:
+            return
+        if correct is None:
+            if answer is None:
+                return
+            correct = answer.strip().lower() == self.last_answer.strip().lower()
+        self.recent.append(bool(correct))
+        self.last_answer = None
+        self.difficulty = next_difficulty(self.difficulty, self.recent)
+
+
+# quiz sessions held by this process, the least recently used first so the
+# expired ones are evicted from the front. a session lives ttl seconds after
+# its last use and the oldest are dropped once limit sessions are open.
+class QuizSessionStore:
+
+    def __init__(self, ttl, limit):
+        self.ttl = ttl
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    # drop expired sessions, and the oldest ones until room more fit in limit
+    def evict(self, now, room=0):
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.expires_at > now and len(self.sessions) + room <= self.limit:
+                break
+            self.sessions.popitem(last=False)
+
+    def create(self, category, current_category, adaptive=False, difficulty=ADAPTIVE_START_DIFFICULTY):
+        now = time.monotonic()
+        session = QuizSession(secrets.token_urlsafe(16), category, current_category, now + self.ttl,
+                              adaptive, difficulty)
+        with self.lock:
+            self.evict(now, room=1)
+            self.sessions[ session.id ] = session
+        return session
+
+    # open session with that id, None if it is unknown or expired
+    def get(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            self.evict(now)
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.expires_at = now + self.ttl
+                self.sessions.move_to_end(session_id)
+        return session
+
+    def delete(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
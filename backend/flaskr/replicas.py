@@ -0,0 +1,131 @@
+import functools
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.expression import UpdateBase
+from models import db, pool_status
+
+
+# cookie sent back by a client that wrote, the time until which its reads go
+# to the primary
+STICKY_COOKIE = 'trivia_read_primary'
+
+
+# read replicas of SQLALCHEMY_REPLICA_URIS, used round-robin by the session
+# (see RoutingSession) for the statements of views marked read_only, one
+# replica for all the reads of a request so they see the same data. writes
+# go to the primary and so do the reads of the client that wrote for
+# REPLICA_STICKY_SECONDS (STICKY_COOKIE), so it reads back what it just wrote
+# while the other clients keep reading from the replicas. a replica whose
+# connection fails is left out for REPLICA_RETRY_SECONDS.
+class ReplicaRouter:
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.replicas = None
+        self.turn = itertools.count()
+        app.extensions[ 'replica_router' ] = self
+        app.after_request(self.mark_writer)
+
+    # engines are created on first use so the uris can be changed after create_app
+    def load(self):
+        with self.lock:
+            if self.replicas is None:
+                options = dict(self.app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+                self.replicas = [ self.replica(uri, options) for uri in
+                                  self.app.config.get('SQLALCHEMY_REPLICA_URIS', [ ]) ]
+        return self.replicas
+
+    def replica(self, uri, options):
+        replica = {'url': make_url(uri), 'down_until': None, 'failures': 0}
+        replica[ 'engine' ] = db.create_engine(replica[ 'url' ], dict(options))
+
+        @event.listens_for(replica[ 'engine' ], 'handle_error')
+        def failed(context):
+            # lost or refused connections, not errors of the statement itself
+            if context.is_disconnect or context.connection is None:
+                replica[ 'failures' ] += 1
+                replica[ 'down_until' ] = time.monotonic() + self.app.config.get('REPLICA_RETRY_SECONDS', 30)
+
+        return replica
+
+    # after_request hook: a request that wrote sends STICKY_COOKIE
+    def mark_writer(self, response):
+        if g.get('wrote'):
+            sticky = self.app.config.get('REPLICA_STICKY_SECONDS', 5)
+            response.set_cookie(STICKY_COOKIE, str(time.time() + sticky), max_age=sticky,
+                                httponly=True, samesite='Lax')
+        return response
+
+    # True while the client of the request may not see its write on a replica
+    def sticky(self):
+        try:
+            return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    # engine the reads of the request go to, None for the primary. the
+    # replica is picked on the first read and kept for the request
+    def replica_engine(self):
+        if not (has_request_context() and g.get('read_replica')) or self.sticky():
+            return None
+        engine = g.get('replica_engine')
+        if engine is None:
+            now = time.monotonic()
+            healthy = [ replica for replica in self.load()
+                        if replica[ 'down_until' ] is None or replica[ 'down_until' ] <= now ]
+            if not healthy:
+                return None
+            engine = g.replica_engine = healthy[ next(self.turn) % len(healthy) ][ 'engine' ]
+        return engine
+
+    # engine a statement of session goes to, None for the primary. a request
+    # that read from a replica is marked replica_read
+    def bind_for(self, session, clause):
+        if session._flushing or isinstance(clause, UpdateBase) or session.info.get('wrote'):
+            session.info[ 'wrote' ] = True
+            if has_request_context():
+                g.wrote = True
+            return None
+        engine = self.replica_engine()
+        if engine is not None:
+            g.replica_read = True
+        return engine
+
+    def status(self):
+        now = time.monotonic()
+        return [ {
+            'url': repr(replica[ 'url' ]),
+            'healthy': replica[ 'down_until' ] is None or replica[ 'down_until' ] <= now,
+            'failures': replica[ 'failures' ],
+            'pool': pool_status(replica[ 'engine' ])
+        } for replica in self.load() ]
+
+
+# decorator for views that only read, their statements may go to a replica
+def read_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# reads that must see the latest writes (the in-memory copies of tables
+# tracking the write generations) go to the primary even in read_only views
+@contextmanager
+def on_primary():
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('read_replica')
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        g.read_replica = previous
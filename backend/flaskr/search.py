@@ -0,0 +1,167 @@
+import re
+from bisect import bisect_left
+from sqlalchemy import func, inspect, literal_column
+from models import db, Question
+from .tracked import PatchedTable
+
+# letters and digits, the same words postgres' 'simple' parser keeps
+WORD = re.compile(r'[^\W_]+')
+
+# rank weights of a match in the question and in the answer, the defaults
+# postgres' ts_rank gives to the A and B labels the migration sets
+QUESTION_WEIGHT = 1.0
+ANSWER_WEIGHT = 0.4
+
+
+def tokenize(text):
+    return WORD.findall((text or '').lower())
+
+
+# full text search on the questions.search_vector column (generated tsvector
+# with the question labelled A and the answer B) through its GIN index.
+# every word of the term is matched as a prefix, like typing in the search box.
+class PostgresSearch:
+
+    def search(self, term, answers, start, limit):
+        words = tokenize(term)
+        if not words:
+            return [ ], 0
+        label = '' if answers else 'A'
+        ts_query = func.to_tsquery('simple', ' & '.join(word + ':*' + label for word in words))
+        search_vector = literal_column('questions.search_vector')
+        query = Question.query.filter(search_vector.op('@@')(ts_query))
+        total = query.count()
+        questions = query.order_by(func.ts_rank(search_vector, ts_query).desc(), Question.id) \
+            .offset(start).limit(limit).all()
+        return questions, total
+
+
+# in-memory inverted index for databases without full text search (sqlite,
+# tests), the same matches and totals as PostgresSearch but ranked only by
+# where the words match, not by how often like ts_rank. single question writes
+# are patched into the postings, it is rebuilt after bulk writes.
+class InvertedIndex(PatchedTable):
+
+    model = Question
+
+    def __init__(self):
+        super().__init__()
+        self.question_postings = {}
+        self.answer_postings = {}
+        self.documents = {}
+        self.words = [ ]
+
+    def read(self):
+        return db.session.query(Question.id, Question.question, Question.answer).all()
+
+    def install(self, rows):
+        self.question_postings = {}
+        self.answer_postings = {}
+        self.documents = {}
+        for row in rows:
+            self.add_postings(row)
+        self.words = sorted(set(self.question_postings) | set(self.answer_postings))
+
+    # the words of a question and of its answer are kept to take them out of
+    # the postings when it changes
+    def add_postings(self, question):
+        document = (tuple(set(tokenize(question.question))), tuple(set(tokenize(question.answer))))
+        self.documents[ question.id ] = document
+        for postings, words in zip((self.question_postings, self.answer_postings), document):
+            for word in words:
+                postings.setdefault(word, set()).add(question.id)
+        return document
+
+    def add(self, question):
+        for words in self.add_postings(question):
+            for word in words:
+                position = bisect_left(self.words, word)
+                if position == len(self.words) or self.words[ position ] != word:
+                    self.words.insert(position, word)
+
+    def remove(self, question_id):
+        document = self.documents.pop(question_id, None)
+        if document is None:
+            return False
+        for postings, words in zip((self.question_postings, self.answer_postings), document):
+            for word in words:
+                ids = postings[ word ]
+                ids.discard(question_id)
+                if ids:
+                    continue
+                del postings[ word ]
+                if word not in self.question_postings and word not in self.answer_postings:
+                    position = bisect_left(self.words, word)
+                    if position < len(self.words) and self.words[ position ] == word:
+                        del self.words[ position ]
+        return True
+
+    # indexed words starting with prefix, found by bisecting the sorted words
+    def complete(self, prefix):
+        words = self.words
+        position = bisect_left(words, prefix)
+        while position < len(words) and words[ position ].startswith(prefix):
+            yield words[ position ]
+            position += 1
+
+    # score of every question matching all words, None when nothing matches
+    def score(self, words, answers):
+        scores = None
+        for word in words:
+            in_question = set()
+            in_answer = set()
+            for match in self.complete(word):
+                in_question.update(self.question_postings.get(match, ()))
+                if answers:
+                    in_answer.update(self.answer_postings.get(match, ()))
+            word_scores = {question_id: QUESTION_WEIGHT * (question_id in in_question) +
+                           ANSWER_WEIGHT * (question_id in in_answer)
+                           for question_id in in_question | in_answer}
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {question_id: scores[ question_id ] + word_score
+                          for question_id, word_score in word_scores.items() if question_id in scores}
+            if not scores:
+                return None
+        return scores
+
+    def search(self, term, answers, start, limit):
+        self.refresh()
+        scores = self.score(tokenize(term), answers)
+        if not scores:
+            return [ ], 0
+        ranked = sorted(scores, key=lambda question_id: (-scores[ question_id ], question_id))
+        page_ids = ranked[ start:start + limit ]
+        questions = {question.id: question for question in Question.query.filter(Question.id.in_(page_ids))}
+        return [ questions[ question_id ] for question_id in page_ids if question_id in questions ], len(ranked)
+
+
+# search used by /questions/search, backend is 'postgres', 'memory' or 'auto'
+# (postgres when the search_vector migration is applied, memory otherwise).
+# auto is resolved on the first search since the database is not known before.
+class QuestionSearch:
+
+    def __init__(self, backend='auto'):
+        self.backend = backend
+        self.engine = None
+
+    def get_engine(self):
+        if self.engine is None:
+            backend = self.backend
+            if backend == 'auto':
+                columns = [ ]
+                if db.engine.dialect.name == 'postgresql':
+                    columns = [ column[ 'name' ] for column in inspect(db.engine).get_columns('questions') ]
+                backend = 'postgres' if 'search_vector' in columns else 'memory'
+            self.engine = PostgresSearch() if backend == 'postgres' else InvertedIndex()
+        return self.engine
+
+    # question observer, passed on to the in-memory index once it is in use
+    def observe(self, event, question):
+        if isinstance(self.engine, InvertedIndex):
+            self.engine.observe(event, question)
+
+    # page of questions matching term ranked best first and the number of matches
+    def search(self, term, answers, start, limit):
+        return self.get_engine().search(term, answers, start, limit)
@@ -0,0 +1,55 @@
+import json
+from flask import request, Response
+from models import Question
+
+# orjson and msgpack are optional, the stdlib encoder is used without orjson
+# and msgpack is only offered when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# columns read for a listed question, same keys as Question.format()
+ROW_FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+ROW_COLUMNS = tuple(getattr(Question, field) for field in ROW_FIELDS)
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+# the question query reading only the listed columns, rows come back as tuples
+# instead of Question instances (no identity map, no attribute tracking)
+def question_rows(query):
+    return query.with_entities(*ROW_COLUMNS)
+
+
+def format_rows(rows):
+    return [ dict(zip(ROW_FIELDS, row)) for row in rows ]
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+# response type picked from the Accept header, json unless the client
+# prefers msgpack and it is installed
+def negotiate():
+    if msgpack is None:
+        return 'application/json'
+    return request.accept_mimetypes.best_match(('application/json',) + MSGPACK_TYPES, 'application/json')
+
+
+# encoded response of a payload, in place of jsonify on the listing endpoints
+def fast_response(payload):
+    mimetype = negotiate()
+    if mimetype in MSGPACK_TYPES:
+        body = msgpack.packb(payload, use_bin_type=True)
+    else:
+        body = dumps(payload)
+    response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
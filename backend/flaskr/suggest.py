@@ -0,0 +1,101 @@
+import sys
+from array import array
+from bisect import bisect_left, insort
+from models import db, Question
+from .search import tokenize
+from .tracked import PatchedTable
+
+# longest question text sent back with a suggestion
+SUGGEST_SNIPPET_LENGTH = 80
+# most index entries looked at for one suggestion request
+SUGGEST_SCAN_LIMIT = 1000
+
+
+# typeahead index of the question texts, the sorted words searched with
+# bisect and the sorted ids of the questions having each word in a compact
+# array. it's built from the database on the first suggestion and then kept
+# up to date by Question.insert/update/delete (see notify_question_observers)
+# so suggestions never touch the database.
+class SuggestIndex(PatchedTable):
+
+    model = Question
+
+    def __init__(self):
+        super().__init__()
+        self.words = [ ]
+        self.postings = {}
+        self.texts = {}
+
+    def read(self):
+        return db.session.query(Question.id, Question.question).order_by(Question.id).all()
+
+    def install(self, rows):
+        self.texts = {}
+        self.postings = {}
+        for question_id, text in rows:
+            self.texts[ question_id ] = text or ''
+            # rows come by id so appending keeps the ids sorted
+            for word in set(tokenize(text)):
+                word = sys.intern(word)
+                self.postings.setdefault(word, array('i')).append(question_id)
+        self.words = sorted(self.postings)
+
+    def add(self, question):
+        text = question.question or ''
+        self.texts[ question.id ] = text
+        for word in set(tokenize(text)):
+            word = sys.intern(word)
+            if word in self.postings:
+                insort(self.postings[ word ], question.id)
+            else:
+                self.postings[ word ] = array('i', [ question.id ])
+                insort(self.words, word)
+
+    def remove(self, question_id):
+        text = self.texts.pop(question_id, None)
+        if text is None:
+            return False
+        for word in set(tokenize(text)):
+            ids = self.postings[ word ]
+            position = bisect_left(ids, question_id)
+            if position < len(ids) and ids[ position ] == question_id:
+                del ids[ position ]
+            if not ids:
+                del self.postings[ word ]
+                del self.words[ bisect_left(self.words, word) ]
+        return True
+
+    # up to limit questions having a word starting with each word of text
+    def suggest(self, text, limit):
+        self.refresh()
+        words = tokenize(text)
+        if not words:
+            return [ ]
+        # walk the ids of the longest word, the fewest to look at
+        words.sort(key=len)
+        prefix = words.pop()
+        suggestions = [ ]
+        seen = set()
+        scanned = 0
+        with self.lock:
+            position = bisect_left(self.words, prefix)
+            while position < len(self.words) and self.words[ position ].startswith(prefix):
+                for question_id in self.postings[ self.words[ position ] ]:
+                    scanned += 1
+                    if scanned > SUGGEST_SCAN_LIMIT or len(suggestions) >= limit:
+                        return suggestions
+                    if question_id in seen:
+                        continue
+                    seen.add(question_id)
+                    text = self.texts[ question_id ]
+                    if words:
+                        question_words = tokenize(text)
+                        if not all(any(question_word.startswith(word) for question_word in question_words)
+                                   for word in words):
+                            continue
+                    suggestions.append({
+                        'id': question_id,
+                        'question': text[ :SUGGEST_SNIPPET_LENGTH ]
+                    })
+                position += 1
+        return suggestions
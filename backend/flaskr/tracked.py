@@ -0,0 +1,177 @@
+import abc
+import threading
+import time
+from flask import current_app
+from models import db, generation, TableVersion
+from .replicas import on_primary
+
+
+# write versions of the tables shared by all the server processes, read from
+# table_versions (migration c4a7e2d91b38) which every write bumps right after
+# its commit (count_write). one small query reads every table's version, at
+# most every INDEX_PROBE_SECONDS for all the in-memory copies and ETags of the
+# process, and again as soon as this process writes. without the table
+# (database not migrated yet) every version is None
+class TableVersions:
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.present = False
+        self.checked_at = None
+        self.versions = {}
+        self.probed_generations = {}
+        self.probed_at = None
+        app.extensions[ 'table_versions' ] = self
+
+    # whether the database has table_versions, looked up again every
+    # INDEX_PROBE_SECONDS until it does so a migration applied while the
+    # server runs is picked up without a restart
+    def available(self):
+        if not self.present and (self.checked_at is None or time.monotonic() - self.checked_at >=
+                                 self.app.config.get('INDEX_PROBE_SECONDS', 5)):
+            self.present = db.engine.has_table(TableVersion.__tablename__)
+            self.checked_at = time.monotonic()
+        return self.present
+
+    # versions of every table in the database the session reads from
+    def read(self):
+        return dict(db.session.query(TableVersion.name, TableVersion.version))
+
+    def probe(self):
+        # generations first, a write of this process committing meanwhile is
+        # then probed again
+        probed_generations = {table: generation(table) for table in ('questions', 'categories')}
+        with on_primary():
+            versions = self.read()
+        with self.lock:
+            self.versions = versions
+            self.probed_generations = probed_generations
+            self.probed_at = time.monotonic()
+
+    # version of table, None when the database has no table_versions
+    def get(self, table):
+        if not self.available():
+            return None
+        if self.probed_at is None or self.probed_generations.get(table) != generation(table) \
+                or time.monotonic() - self.probed_at >= self.app.config.get('INDEX_PROBE_SECONDS', 5):
+            self.probe()
+        return self.versions.get(table)
+
+
+# base of the in-memory copies of a table that follow its write generation.
+# subclasses read the rows of model in read() and swap them in with
+# install(rows), load() records the generation they are from and refresh()
+# reloads when a write moved it since. a copy that follows the writes one by
+# one patches them in with patch(event, question) (see observe and
+# PatchedTable).
+# generations are kept per process, so writes of other processes are caught
+# by comparing the shared version of the table (TableVersions) with the one
+# of the load, and the copy is reloaded in the background every
+# INDEX_MAX_AGE seconds for rows written straight into the database
+class TrackedTable(abc.ABC):
+
+    model = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded_generation = None
+        self.loaded_version = None
+        self.loaded_at = None
+        self.reloader = None
+
+    @property
+    def table(self):
+        return self.model.__tablename__
+
+    @abc.abstractmethod
+    def read(self):
+        pass
+
+    @abc.abstractmethod
+    def install(self, rows):
+        pass
+
+    def version(self):
+        versions = current_app.extensions.get('table_versions')
+        return versions.get(self.table) if versions is not None else None
+
+    def load(self):
+        # read the generation and the version before the rows so a write
+        # racing with the load leaves the copy marked stale
+        current_generation = generation(self.table)
+        now = time.monotonic()
+        current_version = self.version()
+        with on_primary():
+            rows = self.read()
+        with self.lock:
+            self.install(rows)
+            self.loaded_generation = current_generation
+            self.loaded_version = current_version
+            self.loaded_at = now
+
+    # reload on another thread, requests keep reading the current rows meanwhile
+    def reload_in_background(self):
+        with self.lock:
+            if self.reloader is not None and self.reloader.is_alive():
+                return
+            app = current_app._get_current_object()
+
+            def reload():
+                with app.app_context():
+                    self.load()
+
+            self.reloader = threading.Thread(target=reload, daemon=True)
+            self.reloader.start()
+
+    def refresh(self):
+        if self.loaded_generation != generation(self.table) or self.version() != self.loaded_version:
+            self.load()
+        elif time.monotonic() - self.loaded_at >= current_app.config.get('INDEX_MAX_AGE', 300):
+            self.reload_in_background()
+
+    # apply one committed write in place, False when the copy can't (it
+    # already holds the write, or lacks what the write changed)
+    def patch(self, event, question):
+        return False
+
+    # question observer, a write is patched in when the copy was up to date
+    # before it. anything else ('reset', a write the copy missed or can't
+    # patch) leaves the copy stale for the next refresh to reload
+    def observe(self, event, question):
+        with self.lock:
+            current_generation = generation(self.table)
+            if event == 'reset' or self.loaded_generation != current_generation - 1:
+                return
+            if self.patch(event, question):
+                self.loaded_generation = current_generation
+                # the write bumped the shared version once, counted here
+                # without asking the database. a write of another process
+                # meanwhile makes them differ and the copy is reloaded
+                if self.loaded_version is not None:
+                    self.loaded_version += 1
+
+
+# in-memory copy of the questions that patches every single write in with
+# the add(question) and remove(question_id) of the subclass
+class PatchedTable(TrackedTable):
+
+    # put a question in the copy
+    @abc.abstractmethod
+    def add(self, question):
+        pass
+
+    # take a question out of the copy, False if it wasn't there
+    @abc.abstractmethod
+    def remove(self, question_id):
+        pass
+
+    # the copy lacks the question updated or deleted when remove finds
+    # nothing. an insert the copy already holds was read by a load racing
+    # with the write and is replaced
+    def patch(self, event, question):
+        if not self.remove(question.id) and event != 'insert':
+            return False
+        if event != 'delete':
+            self.add(question)
+        return True
@@ -0,0 +1,33 @@
+"""full text search vector on questions
+
+Revision ID: 4d811ca3b6da
+Revises: 2bc5a421cb06
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d811ca3b6da'
+down_revision = '2bc5a421cb06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # generated tsvector of the question (weight A) and answer (weight B) with
+    # the 'simple' configuration (no stemming nor stop words) and its GIN index
+    op.execute("ALTER TABLE questions ADD COLUMN search_vector tsvector "
+               "GENERATED ALWAYS AS ("
+               "setweight(to_tsvector('simple', coalesce(question, '')), 'A') || "
+               "setweight(to_tsvector('simple', coalesce(answer, '')), 'B')"
+               ") STORED;")
+    op.create_index('ix_questions_search_vector', 'questions', ['search_vector'],
+                    unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_questions_search_vector', table_name='questions')
+    op.drop_column('questions', 'search_vector')
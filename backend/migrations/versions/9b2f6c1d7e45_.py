@@ -0,0 +1,29 @@
+"""indexes for the category listings and quiz
+
+Revision ID: 9b2f6c1d7e45
+Revises: 4d811ca3b6da
+Create Date: 2026-10-18 16:40:12.551873
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2f6c1d7e45'
+down_revision = '4d811ca3b6da'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # category listings filter on category and page by id, GET /questions
+    # orders by (category, id); the foreign key alone isn't indexed
+    op.create_index('ix_questions_category_id', 'questions', ['category', 'id'], unique=False)
+    # exports and quiz draws of a category at a difficulty
+    op.create_index('ix_questions_category_difficulty', 'questions', ['category', 'difficulty'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_questions_category_difficulty', table_name='questions')
+    op.drop_index('ix_questions_category_id', table_name='questions')
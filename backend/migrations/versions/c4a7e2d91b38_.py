@@ -0,0 +1,30 @@
+"""write versions of the tables kept in memory
+
+Revision ID: c4a7e2d91b38
+Revises: 9b2f6c1d7e45
+Create Date: 2026-10-18 21:05:47.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a7e2d91b38'
+down_revision = '9b2f6c1d7e45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # one row per table, bumped after every write to it is committed
+    table_versions = op.create_table('table_versions',
+                                     sa.Column('name', sa.String(), nullable=False),
+                                     sa.Column('version', sa.BigInteger(), nullable=False),
+                                     sa.PrimaryKeyConstraint('name'))
+    op.bulk_insert(table_versions, [ {'name': 'questions', 'version': 0},
+                                     {'name': 'categories', 'version': 0} ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
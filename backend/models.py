@@ -1,22 +1,185 @@
 import os
-from flask_migrate import Migrate
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+import click
+from flask import current_app, has_app_context
+from flask.cli import ScriptInfo
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import exc, orm
+from sqlalchemy.pool import QueuePool
 
 # Declare database name
 database_name = "trivia"
 
+# engine options that only mean something for a QueuePool
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+# checkout counters of a connection pool, kept across pool re-creations
+class PoolStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def record(self, wait_time, timed_out=False):
+        with self.lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+
+# QueuePool timing how long each checkout waits for a connection (including
+# opening one when the pool grows into its overflow)
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.stats.record(time.perf_counter() - start, timed_out)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+# state and counters of the connection pool of an engine
+def pool_status(engine):
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'max_overflow': pool._max_overflow,
+            # most connections this process can open, times the worker count
+            # it must fit in the database's max_connections
+            'capacity': pool.size() + max(pool._max_overflow, 0),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0)
+        })
+    stats = getattr(pool, 'stats', None)
+    if stats is not None:
+        status.update({
+            'checkouts': stats.checkouts,
+            'timeouts': stats.timeouts,
+            'wait_seconds_total': round(stats.wait_time, 6),
+            'wait_seconds_max': round(stats.max_wait_time, 6)
+        })
+    return status
+
+
+# session asking the app's replica router (flaskr.replicas) where each
+# statement goes, the primary engine when there is no router or it says None
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get('replica_router')
+        if router is not None:
+            engine = router.bind_for(self, clause)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+# SQLAlchemy creating engines with a TimedQueuePool sized from
+# SQLALCHEMY_ENGINE_OPTIONS, sqlite keeps its own pool and drops the sizes,
+# and sessions that can read from replicas
+class TriviaSQLAlchemy(SQLAlchemy):
+
+    def create_engine(self, sa_url, engine_opts):
+        if sa_url.drivername.startswith('sqlite'):
+            engine_opts = {key: value for key, value in engine_opts.items() if key not in QUEUE_POOL_OPTIONS}
+        else:
+            engine_opts.setdefault('poolclass', TimedQueuePool)
+        return super().create_engine(sa_url, engine_opts)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
 #intiate db with no assigment
-db = SQLAlchemy()
+db = TriviaSQLAlchemy()
+
+# write generation of each table, bumped after every committed write so the
+# in-memory copies kept by the app know when they are stale
+generations = {'questions': 0, 'categories': 0}
+generations_lock = threading.Lock()
+
+
+def bump_generation(table):
+    with generations_lock:
+        generations[table] += 1
+
+
+def generation(table):
+    return generations[table]
+
+
+# bump the version of table shared by all the processes (see TableVersion)
+# once a write to it is committed, in a short transaction of its own so
+# concurrent writers only wait on the version row for that one UPDATE, not
+# for their whole write (a bulk COPY batch). call it after the commit and
+# before bump_generation so this process probes the new version. a write
+# whose process dies in between is only seen after INDEX_MAX_AGE. nothing is
+# counted when the database has no table_versions (not migrated)
+def count_write(table):
+    versions = current_app.extensions.get('table_versions') if has_app_context() else None
+    if versions is not None and versions.available():
+        with db.engine.begin() as connection:
+            connection.execute(TableVersion.__table__.update().where(TableVersion.name == table)
+                               .values(version=TableVersion.version + 1))
+
+
+# in-memory indexes that follow question writes one by one register a
+# callback in app.extensions['question_observers'], it's called after each
+# commit with the event ('insert', 'update' or 'delete') and the question.
+# writes of many rows at once send ('reset', None) instead
+def notify_question_observers(event, question):
+    if has_app_context():
+        for observer in current_app.extensions.get('question_observers', ()):
+            observer(event, question)
+
 
 def setup_db(app,database_name):
     app.config.from_pyfile('config.py')
     app.config['SQLALCHEMY_DATABASE_URI'] += database_name
-    moment = Moment(app)
     db.app = app
     db.init_app(app)
-    # create instance migrate for data migration
-    migrate = Migrate(app, db, compare_type=True)
+    # create instance migrate for data migration, only for apps loaded by the
+    # flask command (flask db ...), servers skip importing alembic
+    context = click.get_current_context(silent=True)
+    if context is not None and context.find_object(ScriptInfo) is not None:
+        setup_migrate(app)
+
+
+def setup_migrate(app):
+    from flask_migrate import Migrate
+    return Migrate(app, db, compare_type=True, include_object=include_object)
+
+
+# schema kept only by migrations (full text search column and index), hidden
+# from autogenerate so it doesn't try to drop it
+MIGRATION_ONLY = ('search_vector', 'ix_questions_search_vector')
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (reflected and compare_to is None and name in MIGRATION_ONLY)
 
 
 '''
@@ -27,6 +190,11 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    # created by migration 9b2f6c1d7e45, checked with flask indexes check
+    __table_args__ = (
+        db.Index('ix_questions_category_id', 'category', 'id'),
+        db.Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     question = db.Column(db.String)
@@ -43,13 +211,22 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        count_write('questions')
+        bump_generation('questions')
+        notify_question_observers('insert', self)
 
     def update(self):
         db.session.commit()
+        count_write('questions')
+        bump_generation('questions')
+        notify_question_observers('update', self)
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        count_write('questions')
+        bump_generation('questions')
+        notify_question_observers('delete', self)
 
     def format(self):
         return {
@@ -76,8 +253,41 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        count_write('categories')
+        bump_generation('categories')
+
+    def update(self):
+        db.session.commit()
+        count_write('categories')
+        bump_generation('categories')
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+        count_write('categories')
+        bump_generation('categories')
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
         }
+
+
+'''
+TableVersion
+
+'''
+
+
+# write counter of each table the app keeps in memory, bumped right after
+# every write to the table is committed (count_write) so all the server
+# processes read the same versions. created by migration c4a7e2d91b38
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
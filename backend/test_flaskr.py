@@ -1,10 +1,21 @@
+import asyncio
+import gzip
 import os
+import tempfile
 import unittest
 import json
+import sqlalchemy
 from flask_sqlalchemy import SQLAlchemy
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.asgi import AsgiApp, build_environ
+from flaskr.quiz import QuestionIndex, ALL_CATEGORIES
+from flaskr.search import InvertedIndex, PostgresSearch
+from models import setup_db, db, generation, Question, Category, TableVersion
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -64,6 +75,36 @@ class TriviaTestCase(unittest.TestCase):
         """Executed after reach test"""
         pass
 
+    # the shared table versions of migration c4a7e2d91b38, dropped once the test is done
+    def create_table_versions(self):
+        with self.app.app_context():
+            TableVersion.__table__.create(bind=db.engine)
+            self.addCleanup(TableVersion.__table__.drop, db.engine)
+            db.session.execute(TableVersion.__table__.insert(), [ {'name': 'questions', 'version': 0},
+                                                                  {'name': 'categories', 'version': 0} ])
+            db.session.commit()
+
+    # run one asgi request receiving messages, returns the messages sent back
+    def run_asgi(self, asgi_app, scope, messages):
+        sent = [ ]
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(asgi_app(scope, receive, send))
+        return sent
+
+    # delete the questions having one of these texts once the test is done
+    def cleanup_questions(self, texts):
+        with self.app.app_context():
+            ids = [ question_id for question_id, in
+                    db.session.query(Question.id).filter(Question.question.in_(texts)) ]
+        if ids:
+            self.addCleanup(self.client().delete, '/questions/batch', json={'ids': ids})
+
 
     # test get all questions if exist
     def test_get_questions_per_page(self):
@@ -245,6 +286,876 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data[ 'message' ],
                          'Not found!!! : please check your Data or maybe your request is currently not available.')
 
+    # test paging is cut by the database and total counts the whole table
+    def test_get_questions_second_page(self):
+        """Test that a second page holds at most 10 questions and the total is still the whole bank """
+        res = self.client().get('/questions?page=2')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'success' ], True)
+        self.assertTrue(len(data[ 'questions' ]) <= 10)
+        self.assertTrue(data[ 'total_questions' ] > 10)
+
+    # test walking all questions with a keyset cursor instead of page numbers
+    def test_get_questions_with_cursor(self):
+        """Test that the cursor of a page leads to the following page with no repeated questions """
+        res = self.client().get('/questions?cursor=')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'success' ], True)
+        self.assertEqual(len(data[ 'questions' ]), 10)
+        self.assertTrue(data[ 'next_cursor' ])
+
+        res = self.client().get('/questions?cursor=' + data[ 'next_cursor' ])
+        next_data = json.loads(res.data)
+        first_ids = [ question[ 'id' ] for question in data[ 'questions' ] ]
+        next_ids = [ question[ 'id' ] for question in next_data[ 'questions' ] ]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(set(first_ids) & set(next_ids))
+
+    # test following the cursors lists every question once, those without a category too
+    def test_questions_cursor_walks_every_question(self):
+        """Test that paging by cursor to the last page sends each question exactly once """
+        total = json.loads(self.client().get('/questions').data)[ 'total_questions' ]
+        ids = [ ]
+        cursor = ''
+        while cursor is not None:
+            res = self.client().get('/questions?cursor=' + cursor)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            ids.extend(question[ 'id' ] for question in data[ 'questions' ])
+            cursor = data[ 'next_cursor' ]
+
+        self.assertEqual(len(ids), total)
+        self.assertEqual(len(set(ids)), total)
+
+    # test a broken cursor is refused
+    def test_error_questions_with_invalid_cursor(self):
+        """Test that sending a cursor that was not issued by the API will abort 400 """
+        res = self.client().get('/questions?cursor=not-a-cursor')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data[ 'success' ], False)
+
+    # test the in-memory categories pick up a category written after they were loaded
+    def test_categories_reload_after_category_write(self):
+        """Test that a new category shows in categories once inserted and goes away once deleted """
+        self.client().get('/categories')
+        with self.app.app_context():
+            category = Category(type='Music')
+            category.insert()
+            category_id = category.id
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn({'id': category_id, 'type': 'Music'}, data[ 'categories' ])
+
+        with self.app.app_context():
+            Category.query.get(category_id).delete()
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertNotIn({'id': category_id, 'type': 'Music'}, data[ 'categories' ])
+
+    # test values int() would turn into a category id are refused
+    def test_error_category_not_an_id(self):
+        """Test that true or 1.7 sent as category are not taken for category 1 """
+        for category in (True, 1.7):
+            res = self.client().post('category/quiz/questions', json={'previousQuestions': [ ], 'category': category})
+
+            self.assertEqual(res.status_code, 404)
+
+    # test the quiz only sends the question left and then reports the category is done
+    def test_quiz_category_exhausted(self):
+        """Test that the quiz never repeats a previous question and sends no question once all were played """
+        # every id of the category, not only its first page
+        res = self.client().get('/questions/export?category=2')
+        ids = [ json.loads(line)[ 'id' ] for line in res.data.decode('utf-8').splitlines() ]
+
+        res = self.client().post('category/quiz/questions', json={'previousQuestions': ids[ 1: ], 'category': 2})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'question' ][ 'id' ], ids[ 0 ])
+
+        res = self.client().post('category/quiz/questions', json={'previousQuestions': ids, 'category': 2})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'success' ], True)
+        self.assertEqual(data[ 'question' ], None)
+        self.assertEqual(data[ 'total_category_questions' ], len(ids))
+
+    # test a quiz session sends every question of the category once then stops
+    def test_quiz_session_plays_category_once(self):
+        """Test that a quiz session never repeats a question and ends with no question """
+        res = self.client().post('/quiz/sessions', json={'category': 3})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'success' ], True)
+        self.assertTrue(data[ 'session_id' ])
+
+        session_id = data[ 'session_id' ]
+        played = [ ]
+        for _ in range(data[ 'total_category_questions' ]):
+            res = self.client().post('/quiz/sessions/' + session_id + '/next')
+            played.append(json.loads(res.data)[ 'question' ][ 'id' ])
+        res = self.client().post('/quiz/sessions/' + session_id + '/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(len(set(played)), len(played))
+        self.assertEqual(data[ 'question' ], None)
+        self.assertEqual(data[ 'played_questions' ], len(played))
+
+    # test an adaptive quiz session follows the player's answers
+    def test_adaptive_quiz_session(self):
+        """Test that an adaptive session moves its difficulty up after right answers and down after wrong ones """
+        res = self.client().post('/quiz/sessions', json={'category': 2, 'adaptive': True, 'difficulty': 1})
+        session_id = json.loads(res.data)[ 'session_id' ]
+        res = self.client().post('/quiz/sessions/' + session_id + '/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'question' ][ 'difficulty' ], 1)
+        self.assertEqual(data[ 'difficulty' ], 1)
+
+        for _ in range(3):
+            res = self.client().post('/quiz/sessions/' + session_id + '/next',
+                                     json={'answer': data[ 'question' ][ 'answer' ]})
+            data = json.loads(res.data)
+        self.assertEqual(data[ 'difficulty' ], 2)
+
+        res = self.client().post('/quiz/sessions', json={'category': 2, 'adaptive': True, 'difficulty': 3})
+        session_id = json.loads(res.data)[ 'session_id' ]
+        self.client().post('/quiz/sessions/' + session_id + '/next')
+        self.client().post('/quiz/sessions/' + session_id + '/next', json={'correct': False})
+        res = self.client().post('/quiz/sessions/' + session_id + '/next', json={'answer': 'not the answer'})
+        data = json.loads(res.data)
+
+        self.assertEqual(data[ 'difficulty' ], 2)
+
+    # test asking a question from a session that does not exist
+    def test_error_quiz_session_not_exist(self):
+        """Test that an unknown quiz session will abort 404 """
+        res = self.client().post('/quiz/sessions/nosuchsession/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data[ 'success' ], False)
+
+    # test starting a quiz session without a usable category
+    def test_error_start_quiz_session(self):
+        """Test that a quiz session without a body or with a malformed category will abort 400 """
+        res = self.client().post('/quiz/sessions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data[ 'success' ], False)
+        self.assertEqual(self.client().post('/quiz/sessions', json={'category': '1'}).status_code, 400)
+
+    # test searching the answers too when asked
+    def test_search_user_question_answers(self):
+        """Test that a word only found in an answer matches when searchAnswers is sent """
+        res = self.client().post('/questions/search', json={'searchTerm': 'mona'})
+
+        self.assertEqual(res.status_code, 422)
+
+        res = self.client().post('/questions/search', json={'searchTerm': 'mona', 'searchAnswers': True})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'total_questions' ], 1)
+        self.assertEqual(data[ 'questions' ][ 0 ][ 'answer' ], 'Mona Lisa')
+
+    # test typeahead suggestions follow the questions added and deleted
+    def test_suggest_questions(self):
+        """Test that suggestions match word prefixes and follow inserted and deleted questions """
+        res = self.client().get('/questions/suggest?q=pean')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'success' ], True)
+        self.assertIn('Who invented Peanut Butter?', [ suggestion[ 'question' ] for suggestion in data[ 'suggestions' ] ])
+
+        with self.app.app_context():
+            question = Question(question='Which planet is the Zorblaxian homeworld?', answer='None',
+                                difficulty=1, category=1)
+            question.insert()
+            question_id = question.id
+        res = self.client().get('/questions/suggest?q=zorbl')
+        data = json.loads(res.data)
+
+        self.assertEqual([ suggestion[ 'id' ] for suggestion in data[ 'suggestions' ] ], [ question_id ])
+
+        self.client().delete('/questions/' + str(question_id))
+        res = self.client().get('/questions/suggest?q=zorbl')
+        data = json.loads(res.data)
+
+        self.assertEqual(data[ 'suggestions' ], [ ])
+
+    # test importing questions in bulk keeps the good rows and reports the bad ones
+    def test_bulk_import_questions(self):
+        """Test that a bulk import inserts the valid rows and lists the refused ones by line """
+        body = '\n'.join([
+            json.dumps({'question': 'bulk question 1', 'answer': 'one', 'difficulty': 1, 'category': 1}),
+            json.dumps({'question': 'bulk question 2', 'answer': 'two', 'difficulty': 2}),
+            'not json',
+            json.dumps({'question': 'bulk question 3', 'answer': 'three', 'difficulty': 3, 'category': 1000}),
+            json.dumps({'question': 'bulk question 4', 'answer': 'four', 'difficulty': 4, 'category': 2}),
+            json.dumps({'question': 'bulk question 5', 'answer': 'five', 'difficulty': 99, 'category': 2}),
+        ])
+        res = self.client().post('/questions/bulk', data=body, content_type='application/x-ndjson')
+        self.cleanup_questions([ 'bulk question 1', 'bulk question 4' ])
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'success' ], True)
+        self.assertEqual(data[ 'inserted' ], 2)
+        self.assertEqual(data[ 'failed' ], 4)
+        self.assertEqual([ error[ 'line' ] for error in data[ 'errors' ] ], [ 2, 3, 4, 6 ])
+
+    # test importing questions from csv
+    def test_bulk_import_questions_csv(self):
+        """Test that a csv bulk import reads the header and inserts the rows """
+        body = 'question,answer,difficulty,category\n"bulk, csv question",csv answer,2,3\n'
+        res = self.client().post('/questions/bulk', data=body, content_type='text/csv')
+        self.cleanup_questions([ 'bulk, csv question' ])
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'inserted' ], 1)
+        self.assertEqual(data[ 'failed' ], 0)
+
+    # test exporting the questions of a category
+    def test_export_questions(self):
+        """Test that an export streams one line per question of the category asked """
+        res = self.client().get('/questions/export?category=3')
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(len(lines))
+        self.assertTrue(all(json.loads(line)[ 'category' ] == 3 for line in lines))
+
+        res = self.client().get('/questions/export?category=3&format=csv')
+        csv_lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(csv_lines[ 0 ], 'id,question,answer,difficulty,category')
+        self.assertEqual(len(csv_lines), len(lines) + 1)
+
+    # test revalidating categories with their ETag
+    def test_categories_not_modified(self):
+        """Test that sending back the ETag answers 304 until a category is written """
+        self.create_table_versions()
+        res = self.client().get('/categories')
+        etag = res.headers[ 'ETag' ]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(etag)
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+        with self.app.app_context():
+            category = Category(type='Music')
+            category.insert()
+            category.delete()
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers[ 'ETag' ], etag)
+
+    # test no ETag is sent while the other processes' writes can't be seen
+    def test_no_etag_without_table_versions(self):
+        """Test that without table_versions listings are sent untagged and never answered 304 """
+        res = self.client().get('/categories')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('ETag', res.headers)
+        self.assertEqual(self.client().get('/categories', headers={'If-None-Match': '*'}).status_code, 200)
+
+    # test repeated listings are served from the response cache until a question is added
+    def test_questions_response_cache(self):
+        """Test that a repeated listing is a cache hit and that adding a question invalidates it """
+        self.client().get('/questions?page=2')
+        res = self.client().get('/questions?page=2')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers[ 'X-Cache' ], 'HIT')
+
+        self.client().post('/questions', json=self.new_question)
+        res = self.client().get('/questions?page=2')
+
+        self.assertEqual(res.headers[ 'X-Cache' ], 'MISS')
+
+        res = self.client().get('/admin/cache')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data[ 'cache' ][ 'hits' ])
+        self.assertTrue(data[ 'cache' ][ 'misses' ])
+
+    # test the response cache drops what another process' write changed
+    def test_response_cache_sees_writes_of_other_processes(self):
+        """Test that a cached listing is read again once another app wrote, under its new ETag """
+        self.app.config[ 'INDEX_PROBE_SECONDS' ] = 0
+        self.create_table_versions()
+        other = create_app()
+        setup_db(other, self.database_name)
+        self.client().get('/categories')
+
+        self.assertEqual(self.client().get('/categories').headers[ 'X-Cache' ], 'HIT')
+
+        with other.app_context():
+            category = Category(type='Music')
+            category.insert()
+            category_id = category.id
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.headers[ 'X-Cache' ], 'MISS')
+        self.assertIn({'id': category_id, 'type': 'Music'}, data[ 'categories' ])
+        self.assertEqual(other.test_client().get('/categories').headers[ 'ETag' ], res.headers[ 'ETag' ])
+        with self.app.app_context():
+            Category.query.get(category_id).delete()
+
+    # test adding and deleting a question with minimal responses
+    def test_minimal_write_responses(self):
+        """Test that ?return=minimal answers writes with only the id and an up to date total """
+        res = self.client().get('/questions')
+        total = json.loads(res.data)[ 'total_questions' ]
+
+        res = self.client().post('/questions?return=minimal', json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data[ 'created' ])
+        self.assertEqual(data[ 'total_questions' ], total + 1)
+        self.assertNotIn('questions', data)
+
+        res = self.client().delete('/questions/' + str(data[ 'created' ]),
+                                   headers={'Prefer': 'return=minimal'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'total_questions' ], total)
+        self.assertNotIn('current_questions', data)
+
+    # test the connection pool report
+    def test_pool_stats(self):
+        """Test that the pool report names the pool in use """
+        res = self.client().get('/admin/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'success' ], True)
+        self.assertTrue(data[ 'pool' ][ 'pool' ])
+
+    # test request metrics are exposed for prometheus
+    def test_metrics(self):
+        """Test that a served request shows in the metrics with its latency and queries """
+        self.client().get('/questions')
+        res = self.client().get('/metrics')
+        text = res.data.decode('utf-8')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_requests_total{endpoint="get_questions_per_page",method="GET",status="200"} 1', text)
+        self.assertIn('trivia_request_duration_seconds_count{endpoint="get_questions_per_page"} 1', text)
+        self.assertIn('trivia_request_queries_count{endpoint="get_questions_per_page"} 1', text)
+
+    # test a request failing with an unhandled exception is counted as a 500
+    def test_metrics_count_unhandled_errors(self):
+        """Test that a view raising past the error handlers shows in the metrics as a 500 """
+        self.app.config[ 'PROPAGATE_EXCEPTIONS' ] = True
+
+        @self.app.route('/_test/fail')
+        def failing_view():
+            raise RuntimeError('failing view')
+
+        with self.assertRaises(RuntimeError):
+            self.client().get('/_test/fail')
+        text = self.client().get('/metrics').data.decode('utf-8')
+
+        self.assertIn('trivia_requests_total{endpoint="failing_view",method="GET",status="500"} 1', text)
+        self.assertIn('trivia_request_duration_seconds_count{endpoint="failing_view"} 1', text)
+
+    # test the sql profiler reports the statements of a request
+    def test_sql_profiler(self):
+        """Test that a profiled request is reported with its statements and duplicates """
+        self.app.config[ 'SQL_PROFILER_HEADER' ] = True
+        res = self.client().post('category/questions', json=self.category_1, headers={'X-Profile-Queries': '1'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(int(res.headers[ 'X-SQL-Queries' ]))
+
+        res = self.client().get('/_debug/queries')
+        data = json.loads(res.data)
+        report = data[ 'reports' ][ 0 ]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(report[ 'endpoint' ], 'get_category_questions_per_page')
+        self.assertEqual(report[ 'count' ], len(report[ 'statements' ]))
+        self.assertEqual(report[ 'duplicates' ], [ ])
+
+    # test a failing statement doesn't leave its start time on the connection
+    def test_sql_profiler_failed_statement(self):
+        """Test that the profiler drops the start of a statement that raised """
+        self.app.config[ 'SQL_PROFILER' ] = True
+        with self.app.test_request_context('/questions'):
+            self.app.preprocess_request()
+            with db.engine.connect() as connection:
+                with self.assertRaises(sqlalchemy.exc.DBAPIError):
+                    connection.execute('SELECT no_such_column FROM questions')
+
+                self.assertFalse(connection.info.get('profiler_starts'))
+
+    # test the profiler report page is hidden while the profiler is off
+    def test_error_sql_profiler_off(self):
+        """Test that the profiler reports abort 404 when the profiler is off """
+        self.app.config[ 'SQL_PROFILER' ] = False
+        self.app.config[ 'SQL_PROFILER_HEADER' ] = False
+        res = self.client().get('/_debug/queries')
+
+        self.assertEqual(res.status_code, 404)
+
+    # test the asgi mode serves the same routes as the flask app
+    def test_asgi_app(self):
+        """Test that a request sent through the asgi app is answered by the flask views """
+        asgi_app = AsgiApp(self.app, workers=2)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/category/questions', 'query_string': b'page=1',
+                 'headers': [ (b'content-type', b'application/json') ]}
+        body = json.dumps(self.category_1).encode('utf-8')
+        messages = [ {'type': 'http.request', 'body': body[ :5 ], 'more_body': True},
+                     {'type': 'http.request', 'body': body[ 5: ]} ]
+
+        sent = self.run_asgi(asgi_app, scope, messages)
+        data = json.loads(b''.join(message.get('body', b'') for message in sent))
+
+        self.assertEqual(sent[ 0 ][ 'status' ], 200)
+        self.assertEqual(data[ 'success' ], True)
+        self.assertTrue(data[ 'total_category_questions' ])
+
+    # test the asgi mode drops a request whose client left during the body
+    def test_asgi_client_disconnect(self):
+        """Test that a request cut off before the end of its body never reaches the view """
+        asgi_app = AsgiApp(self.app, workers=2)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/questions', 'query_string': b'',
+                 'headers': [ (b'content-type', b'application/json') ]}
+        body = json.dumps(self.new_question).encode('utf-8')
+        messages = [ {'type': 'http.request', 'body': body[ :-1 ], 'more_body': True},
+                     {'type': 'http.disconnect'} ]
+
+        with self.app.app_context():
+            total = Question.query.count()
+        sent = self.run_asgi(asgi_app, scope, messages)
+
+        self.assertEqual(sent, [ ])
+        with self.app.app_context():
+            self.assertEqual(Question.query.count(), total)
+
+    # test a body larger than ASGI_BUFFER_SIZE is streamed to the view
+    def test_asgi_streamed_body(self):
+        """Test that a bulk import sent in many messages past the buffer size is read whole by the view """
+        self.app.config[ 'ASGI_BUFFER_SIZE' ] = 64
+        asgi_app = AsgiApp(self.app, workers=2)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/questions/bulk', 'query_string': b'',
+                 'headers': [ (b'content-type', b'application/x-ndjson') ]}
+        lines = [ json.dumps({'question': 'streamed question %d' % number, 'answer': 'streamed',
+                              'difficulty': 1, 'category': 1}) + '\n' for number in range(10) ]
+        messages = [ {'type': 'http.request', 'body': line.encode('utf-8'), 'more_body': True} for line in lines ]
+        messages.append({'type': 'http.request', 'body': b'', 'more_body': False})
+
+        sent = self.run_asgi(asgi_app, scope, messages)
+        self.cleanup_questions([ 'streamed question %d' % number for number in range(10) ])
+        data = json.loads(b''.join(message.get('body', b'') for message in sent[ 1: ]))
+
+        self.assertEqual(sent[ 0 ][ 'status' ], 200)
+        self.assertEqual(data[ 'inserted' ], 10)
+        self.assertEqual(data[ 'failed' ], 0)
+        self.assertEqual(messages, [ ])
+
+    # test headers sent more than once are joined the way wsgi expects
+    def test_asgi_repeated_headers(self):
+        """Test that split cookie headers join with '; ' and other repeated headers with ',' """
+        scope = {'type': 'http', 'method': 'GET', 'path': '/categories', 'query_string': b'',
+                 'headers': [ (b'cookie', b'a=1'), (b'cookie', b'trivia_read_primary=2'),
+                              (b'accept', b'application/json'), (b'accept', b'text/plain') ]}
+        environ = build_environ(scope, b'')
+
+        self.assertEqual(environ[ 'HTTP_COOKIE' ], 'a=1; trivia_read_primary=2')
+        self.assertEqual(environ[ 'HTTP_ACCEPT' ], 'application/json,text/plain')
+
+    # test batch update and fetch of questions by id
+    def test_batch_update_questions(self):
+        """Test that a batch update moves the found questions and reports the missing ids """
+        res = self.client().post('/questions?return=minimal', json=self.new_question)
+        created = json.loads(res.data)[ 'created' ]
+        self.addCleanup(self.client().delete, '/questions/' + str(created))
+        res = self.client().patch('/questions/batch', json={'ids': [ created, 100000 ], 'difficulty': 5})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'updated' ], 1)
+        self.assertEqual(data[ 'results' ], [ {'id': created, 'status': 'updated'},
+                                              {'id': 100000, 'status': 'not_found'} ])
+
+        res = self.client().get('/questions?ids=%d,100000' % created)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'questions' ][ 0 ][ 'difficulty' ], 5)
+        self.assertEqual(data[ 'missing' ], [ 100000 ])
+
+        res = self.client().patch('/questions/batch', json={'ids': [ created ], 'difficulty': 99})
+
+        self.assertEqual(res.status_code, 400)
+
+    # test batch delete of questions
+    def test_batch_delete_questions(self):
+        """Test that a batch delete removes the questions in one request and refuses bad id lists """
+        ids = [ json.loads(self.client().post('/questions?return=minimal', json=self.new_question).data)[ 'created' ]
+                for _ in range(2) ]
+        res = self.client().delete('/questions/batch', json={'ids': ids})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'deleted' ], 2)
+        self.assertEqual(Question.query.filter(Question.id.in_(ids)).count(), 0)
+
+        res = self.client().delete('/questions/batch', json={'ids': 'all'})
+
+        self.assertEqual(res.status_code, 400)
+
+    # test listings can be asked as msgpack and are cached apart from json
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_questions_msgpack(self):
+        """Test that Accept: application/msgpack gets the same page packed, with its own cache entry and ETag """
+        self.create_table_versions()
+        res_json = self.client().get('/questions')
+        res = self.client().get('/questions', headers={'Accept': 'application/msgpack'})
+        data = msgpack.unpackb(res.data, raw=False)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/msgpack')
+        self.assertEqual(res.headers[ 'X-Cache' ], 'MISS')
+        self.assertIn('Accept', res.headers[ 'Vary' ])
+        self.assertNotEqual(res.headers[ 'ETag' ], res_json.headers[ 'ETag' ])
+        self.assertEqual(data, json.loads(res_json.data))
+
+    # test the index check explains every hot query
+    def test_indexes_check(self):
+        """Test that flask indexes check finds the index of each hot query once the migration's indexes exist """
+        # the indexes of the migration, missing from a database loaded from trivia.psql
+        with self.app.app_context():
+            existing = [ index[ 'name' ] for index in sqlalchemy.inspect(db.engine).get_indexes('questions') ]
+            for index in Question.__table__.indexes:
+                if index.name not in existing:
+                    index.create(bind=db.engine)
+                    self.addCleanup(index.drop, bind=db.engine)
+        res = self.app.test_cli_runner().invoke(args=[ 'indexes', 'check' ])
+
+        self.assertEqual(res.exit_code, 0)
+        for name in ('category page', 'category cursor page', 'questions page', 'category count',
+                     'category difficulty'):
+            self.assertIn('ok      ' + name + ':', res.output)
+
+    # test read only views read from a replica until the client writes
+    def test_read_replica_routing(self):
+        """Test that GET /questions?ids= reads from the replica, and from the primary right after the client writes """
+        replica_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        replica_file.close()
+        self.addCleanup(os.remove, replica_file.name)
+        replica = sqlalchemy.create_engine('sqlite:///' + replica_file.name)
+        Question.metadata.create_all(replica)
+        replica.execute("INSERT INTO categories (id, type) VALUES (1, 'Science')")
+        replica.execute("INSERT INTO questions (id, question, answer, difficulty, category) "
+                        "VALUES (999999, 'only on the replica', 'yes', 1, 1)")
+        self.app.config[ 'SQLALCHEMY_REPLICA_URIS' ] = [ 'sqlite:///' + replica_file.name ]
+
+        res = self.client().get('/questions?ids=999999')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data[ 'questions' ][ 0 ][ 'question' ], 'only on the replica')
+        # without table_versions a replica can't tell its version, nor is
+        # what it answered cached
+        self.assertNotIn('ETag', res.headers)
+        self.assertEqual(self.client().get('/questions?ids=999999').headers[ 'X-Cache' ], 'MISS')
+
+        writer = self.client()
+        res = writer.post('/questions?return=minimal', json=self.new_question)
+        self.addCleanup(self.client().delete, '/questions/' + str(json.loads(res.data)[ 'created' ]))
+        res = writer.get('/questions?ids=999999')
+
+        self.assertEqual(res.status_code, 404)
+
+        # other clients keep reading from the replica
+        res = self.client().get('/questions?ids=999999')
+
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get('/admin/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(data[ 'replicas' ][ 0 ][ 'healthy' ], True)
+
+    # test large responses are gzipped for clients accepting it
+    def test_gzip_responses(self):
+        """Test that pages and streamed exports are gzipped when asked, and small bodies are not """
+        res = self.client().get('/questions')
+        res_gzip = self.client().get('/questions', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res_gzip.status_code, 200)
+        self.assertEqual(res_gzip.headers[ 'Content-Encoding' ], 'gzip')
+        self.assertIn('Accept-Encoding', res_gzip.headers[ 'Vary' ])
+        self.assertEqual(gzip.decompress(res_gzip.data), res.data)
+
+        res = self.client().get('/questions/export')
+        res_gzip = self.client().get('/questions/export', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res_gzip.headers[ 'Content-Encoding' ], 'gzip')
+        self.assertEqual(gzip.decompress(res_gzip.data), res.data)
+
+        res = self.client().get('/questions/suggest?q=zzzz', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    # test bursts past the rate limit are refused with 429
+    def test_error_rate_limited(self):
+        """Test that a client past its burst gets 429 with Retry-After and the refusal is counted """
+        self.app.config[ 'RATE_LIMITS' ] = {'search': {'rate': 0.01, 'burst': 1}}
+        res = self.client().post('/questions/search', json=self.search_1)
+
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().post('/questions/search', json=self.search_1)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data[ 'success' ], False)
+        self.assertTrue(int(res.headers[ 'Retry-After' ]) > 1)
+        self.assertIn('trivia_shed_total{endpoint="search",reason="rate"} 1',
+                      self.client().get('/metrics').data.decode('utf-8'))
+
+    # test requests past the concurrency cap are shed with 503
+    def test_error_concurrency_shed(self):
+        """Test that requests over the concurrency cap of an endpoint get 503 with Retry-After """
+        self.app.config[ 'RATE_LIMITS' ] = {'quiz': {'concurrency': 0}}
+        res = self.client().post('/category/quiz/questions', json=self.quiz_1)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data[ 'error' ], 503)
+        self.assertEqual(res.headers[ 'Retry-After' ], '1')
+
+        res = self.client().get('/admin/limits')
+        data = json.loads(res.data)
+
+        self.assertEqual(data[ 'limits' ][ 'shed' ], [ {'endpoint': 'quiz', 'reason': 'concurrency', 'count': 1} ])
+
+    # test the quiz session endpoints share the quiz rate limit
+    def test_error_quiz_session_rate_limited(self):
+        """Test that starting a quiz session and drawing its questions take tokens of the quiz limit """
+        self.app.config[ 'RATE_LIMITS' ] = {'quiz': {'rate': 0.01, 'burst': 2}}
+        res = self.client().post('/quiz/sessions', json={'category': 1})
+        session_id = json.loads(res.data)[ 'session_id' ]
+        res = self.client().post('/quiz/sessions/' + session_id + '/next')
+
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().post('/quiz/sessions/' + session_id + '/next')
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(self.client().post('/quiz/sessions', json={'category': 1}).status_code, 429)
+
+    # test a minimal write doesn't probe the whole questions table
+    def test_minimal_write_runs_no_aggregate(self):
+        """Test that a minimal question insert runs no count or max over the table """
+        self.app.config[ 'SQL_PROFILER_HEADER' ] = True
+        self.client().get('/questions/suggest?q=pean')
+        self.client().post('/quiz/sessions', json={'category': 1})
+        res = self.client().post('/questions?return=minimal', json=self.new_question,
+                                 headers={'X-Profile-Queries': '1'})
+        created = json.loads(res.data)[ 'created' ]
+        res = self.client().post('/quiz/sessions', json={'category': 1}, headers={'X-Profile-Queries': '1'})
+
+        self.assertEqual(res.status_code, 200)
+        res = self.client().get('/_debug/queries')
+        statements = [ statement[ 'sql' ].lower() for report in json.loads(res.data)[ 'reports' ]
+                       for statement in report[ 'statements' ] ]
+
+        self.assertTrue(statements)
+        self.assertFalse([ sql for sql in statements if 'count(' in sql or 'max(' in sql ])
+        self.client().delete('/questions/' + str(created))
+
+    # test every process tags the same data with the same ETag
+    def test_etag_shared_by_processes(self):
+        """Test that an ETag given by one app is answered 304 by another until either writes """
+        self.app.config[ 'INDEX_PROBE_SECONDS' ] = 0
+        self.create_table_versions()
+        other = create_app()
+        setup_db(other, self.database_name)
+        etag = self.client().get('/categories').headers[ 'ETag' ]
+        res = other.test_client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+
+        with other.app_context():
+            category = Category(type='Music')
+            category.insert()
+            category_id = category.id
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(other.test_client().get('/categories').headers[ 'ETag' ], res.headers[ 'ETag' ])
+        with self.app.app_context():
+            Category.query.get(category_id).delete()
+
+    # test the postgres full text search on the search_vector column
+    def test_postgres_search(self):
+        """Test that the tsvector search matches word prefixes, and answers only when asked """
+        with self.app.app_context():
+            if db.engine.dialect.name != 'postgresql':
+                self.skipTest('full text search needs postgres')
+            columns = [ column[ 'name' ] for column in sqlalchemy.inspect(db.engine).get_columns('questions') ]
+            if 'search_vector' not in columns:
+                # the ddl of migration 4d811ca3b6da
+                db.engine.execute("ALTER TABLE questions ADD COLUMN search_vector tsvector "
+                                  "GENERATED ALWAYS AS ("
+                                  "setweight(to_tsvector('simple', coalesce(question, '')), 'A') || "
+                                  "setweight(to_tsvector('simple', coalesce(answer, '')), 'B')"
+                                  ") STORED")
+                db.engine.execute('CREATE INDEX ix_questions_search_vector ON questions USING gin (search_vector)')
+                self.addCleanup(db.engine.execute, 'ALTER TABLE questions DROP COLUMN search_vector')
+            search = PostgresSearch()
+            questions, total = search.search('pean butt', False, 0, 10)
+
+            self.assertIn('Who invented Peanut Butter?', [ question.question for question in questions ])
+            self.assertEqual(total, len(questions))
+            self.assertNotIn(16, [ question.id for question in search.search('esche', False, 0, 10)[ 0 ] ])
+            self.assertIn(16, [ question.id for question in search.search('esche', True, 0, 10)[ 0 ] ])
+
+    # test a load racing with an insert doesn't put the question in the index twice
+    def test_question_index_insert_racing_load(self):
+        """Test that the index reloads instead of adding an insert it already loaded """
+        with self.app.app_context():
+            index = QuestionIndex()
+            question = Question(question='Which question raced the index load?', answer='This one',
+                                difficulty=1, category=1)
+            question.insert()
+            # the load read the generation before the insert and its rows after
+            index.load()
+            index.loaded_generation -= 1
+            index.observe('insert', question)
+
+            self.assertEqual(index.all_ids.count(question.id), 1)
+            self.assertEqual(index.count(), Question.query.count())
+            question.delete()
+
+
+    # test questions left without a category aren't counted twice for all categories
+    def test_question_index_null_category(self):
+        """Test that a question whose category was deleted is in the all categories bucket once """
+        index = QuestionIndex()
+        index.install([ (1, 1, 2), (2, None, 2), (3, None, 3) ])
+
+        self.assertEqual(index.difficulty_ids[ (ALL_CATEGORIES, 2) ], [ 1, 2 ])
+        self.assertEqual(index.difficulty_ids[ (None, 2) ], [ 2 ])
+        self.assertEqual(index.difficulty_ids[ (ALL_CATEGORIES, 3) ], [ 3 ])
+
+    # test table_versions created while the app runs is used without a restart
+    def test_table_versions_migrated_while_running(self):
+        """Test that listings get an ETag once table_versions is created after the first request """
+        self.app.config[ 'INDEX_PROBE_SECONDS' ] = 0
+
+        self.assertNotIn('ETag', self.client().get('/categories').headers)
+
+        self.create_table_versions()
+
+        self.assertIn('ETag', self.client().get('/categories').headers)
+
+    # test the in-memory indexes pick up rows written by another process
+    def test_index_sees_writes_of_other_processes(self):
+        """Test that the quiz index and suggestions find a question another process inserted """
+        self.app.config[ 'INDEX_PROBE_SECONDS' ] = 0
+        self.create_table_versions()
+        self.client().get('/questions/suggest?q=zorbl')
+        res = self.client().post('/quiz/sessions', json={'category': 1})
+        total = json.loads(res.data)[ 'total_category_questions' ]
+        # the write of another process, with its version bump, leaves this
+        # process' generations as they were
+        with self.app.app_context():
+            db.session.execute(Question.__table__.insert().values(
+                question='Which planet is the Zorblaxian homeworld?', answer='None', difficulty=1, category=1))
+            db.session.execute(TableVersion.__table__.update().where(TableVersion.name == 'questions')
+                               .values(version=TableVersion.version + 1))
+            db.session.commit()
+            question_id = db.session.query(db.func.max(Question.id)).scalar()
+        self.addCleanup(self.client().delete, '/questions/' + str(question_id))
+        res = self.client().post('/quiz/sessions', json={'category': 1})
+
+        self.assertEqual(json.loads(res.data)[ 'total_category_questions' ], total + 1)
+
+        res = self.client().get('/questions/suggest?q=zorbl')
+        data = json.loads(res.data)
+
+        self.assertEqual([ suggestion[ 'id' ] for suggestion in data[ 'suggestions' ] ], [ question_id ])
+
+    # test rows written straight into the database show after INDEX_MAX_AGE
+    def test_index_reloads_in_background_past_max_age(self):
+        """Test that an index past INDEX_MAX_AGE is reloaded on another thread """
+        self.app.config[ 'INDEX_MAX_AGE' ] = 0
+        with self.app.app_context():
+            index = QuestionIndex()
+            index.load()
+            total = len(index.all_ids)
+            db.session.execute(Question.__table__.insert().values(
+                question='Which row skipped the app?', answer='This one', difficulty=1, category=1))
+            db.session.commit()
+            question_id = db.session.query(db.func.max(Question.id)).scalar()
+            index.refresh()
+
+            self.assertIsNotNone(index.reloader)
+            index.reloader.join()
+            self.assertEqual(len(index.all_ids), total + 1)
+            Question.query.get(question_id).delete()
+
+    # test the in-memory search index patches single writes instead of reloading
+    def test_search_index_follows_writes(self):
+        """Test that inserted, updated and deleted questions are searched right without a reload """
+        with self.app.app_context():
+            index = InvertedIndex()
+            index.load()
+            question = Question(question='Which moon circles the Zorblaxian homeworld?', answer='Kepler',
+                                difficulty=1, category=1)
+            question.insert()
+            index.observe('insert', question)
+
+            self.assertEqual(index.loaded_generation, generation('questions'))
+            self.assertEqual([ found.id for found in index.search('zorbl', False, 0, 10)[ 0 ] ], [ question.id ])
+
+            question.answer = 'Phobos'
+            question.update()
+            index.observe('update', question)
+
+            self.assertEqual(index.search('kepler', True, 0, 10), ([ ], 0))
+            self.assertEqual([ found.id for found in index.search('phobos', True, 0, 10)[ 0 ] ], [ question.id ])
+
+            question.delete()
+            index.observe('delete', question)
+
+            self.assertEqual(index.loaded_generation, generation('questions'))
+            self.assertEqual(index.search('zorbl', False, 0, 10), ([ ], 0))
+            self.assertNotIn('zorblaxian', index.words)
 
 
 # Make the tests conveniently executable